@@ -0,0 +1,141 @@
+"""
+Find homotypic & heterotypic clusters of motif matches in one sweep.
+
+The tutorial finds clusters by querying a motif map once per match (and,
+for heterotypic clusters, once per factor per match), and then merges
+overlapping regions in a separate pass.  `find_clusters` instead merges
+the sorted match lists of all the factors and slides a window along
+them, keeping a count of the matches of each factor inside it; windows
+with enough matches of every factor are joined into cluster regions as
+it goes.  No index queries are needed, and the cost is linear in the
+total number of matches.
+
+For example, clusters of two or more Dorsal sites within 300 bp:
+
+   >>> clusters = find_clusters({ 'dorsal' : dorsal_matches }, 300,
+   ...                          { 'dorsal' : 2 })
+
+or clusters with at least one Dorsal, two Snail and two Twist sites:
+
+   >>> clusters = find_clusters({ 'dorsal' : dorsal_matches,
+   ...                            'snail' : snail_matches,
+   ...                            'twist' : twist_matches }, 600,
+   ...                          { 'dorsal' : 1, 'snail' : 2, 'twist' : 2 })
+"""
+import heapq
+
+def _tagged(hits, factor):
+    for hit in hits:
+        yield hit[0], factor
+
+def find_clusters(hits_by_factor, window_size, min_counts):
+    """
+    Find clusters of motif matches.
+
+    'hits_by_factor' is a dictionary mapping each factor name to a list
+    of motility-style (start, stop, orientation, match) tuples, sorted by
+    start; only the start positions are used.  A window of 'window_size'
+    bases is started at each match, and it's a cluster if it contains at
+    least min_counts[factor] matches of each factor listed in
+    'min_counts'.  Overlapping cluster windows are merged.
+
+    Returns a list of (start, stop, counts) tuples sorted by start, where
+    'counts' is a dictionary of factor -> number of matches in
+    [start:stop].
+    """
+    factors = hits_by_factor.keys()
+    merged = list(heapq.merge(*[ _tagged(hits_by_factor[f], f)
+                                 for f in factors ]))
+
+    #
+    # slide a window [merged[i] start, + window_size) along the matches,
+    # keeping per-factor counts and the number of factors still short of
+    # their minimum.
+    #
+    counts = dict([ (f, 0) for f in factors ])
+    short = len([ f for f in min_counts if min_counts[f] > 0 ])
+
+    regions = []
+    j = 0
+    for i, (start, factor) in enumerate(merged):
+        stop = start + window_size
+
+        while j < len(merged) and merged[j][0] < stop:
+            f = merged[j][1]
+            counts[f] += 1
+            if counts[f] == min_counts.get(f, 0):
+                short -= 1
+            j += 1
+
+        if short == 0:
+            if regions and start <= regions[-1][1]:
+                regions[-1][1] = max(regions[-1][1], stop)
+            else:
+                regions.append([start, stop])
+
+        # drop match i before moving the window on.
+        counts[factor] -= 1
+        if counts[factor] == min_counts.get(factor, 0) - 1:
+            short += 1
+
+    #
+    # count the matches of each factor in the merged regions.
+    #
+    clusters = []
+    k = 0
+    for (start, stop) in regions:
+        region_counts = dict([ (f, 0) for f in factors ])
+        while k < len(merged) and merged[k][0] < start:
+            k += 1
+        while k < len(merged) and merged[k][0] < stop:
+            region_counts[merged[k][1]] += 1
+            k += 1
+
+        clusters.append((start, stop, region_counts))
+
+    return clusters
+
+def test():
+    import random
+
+    hits = {}
+    for f in ('a', 'b', 'c'):
+        starts = [ random.randint(0, 100000) for i in range(500) ]
+        starts.sort()
+        hits[f] = [ (s, s + 10, 1, '') for s in starts ]
+
+    window = 500
+    min_counts = { 'a' : 2, 'b' : 1 }
+
+    clusters = find_clusters(hits, window, min_counts)
+
+    # brute force: check each window started at a match.
+    expected = []
+    all_starts = []
+    for f in hits:
+        all_starts.extend([ h[0] for h in hits[f] ])
+    all_starts.sort()
+    for s in all_starts:
+        ok = True
+        for f, n in min_counts.items():
+            c = len([ h for h in hits[f] if s <= h[0] < s + window ])
+            if c < n:
+                ok = False
+        if ok:
+            if expected and s <= expected[-1][1]:
+                expected[-1][1] = s + window
+            else:
+                expected.append([s, s + window])
+
+    assert [ (start, stop) for (start, stop, _) in clusters ] == \
+           [ tuple(r) for r in expected ]
+
+    for (start, stop, counts) in clusters:
+        for f in hits:
+            assert counts[f] == len([ h for h in hits[f]
+                                      if start <= h[0] < stop ])
+
+    print 'found %d clusters, all correct' % (len(clusters),)
+
+if __name__ == '__main__':
+    test()
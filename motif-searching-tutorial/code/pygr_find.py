@@ -1,3 +1,4 @@
+import bisect
 from pygr import sequence, cnestedlist, seqdb
 
 def extract_closest(features, position):
@@ -37,14 +38,251 @@ def find_nearest_feature(map, sequence, position, span=1024, factor=10):
 
     return extract_closest(features, position)
 
+def _feature_coords(feature):
+    """
+    Return (seq_id, start, stop, strand) for an annotation, with start &
+    stop on the forward strand.
+    """
+    s = feature.sequence
+    if s.start < 0:                     # reverse strand
+        return s.path.id, -s.stop, -s.start, -1
+    return s.path.id, s.start, s.stop, 1
+
+class _SortedFeatures:
+    """
+    Features on one sequence, sorted by start and by (stop - 1).
+    """
+    def __init__(self, features):
+        by_start = [ (start, stop, f) for (start, stop, f) in features ]
+        by_start.sort(key=lambda x: (x[0], x[1]))
+        self.starts = [ x[0] for x in by_start ]
+        self.stops = [ x[1] for x in by_start ]
+        self.by_start = [ x[2] for x in by_start ]
+
+        # running max of the stops, for overlap queries.
+        self.max_stops = []
+        for stop in self.stops:
+            if self.max_stops:
+                stop = max(stop, self.max_stops[-1])
+            self.max_stops.append(stop)
+
+        by_end = [ (stop - 1, start, f) for (start, stop, f) in features ]
+        by_end.sort(key=lambda x: (x[0], x[1]))
+        self.lasts = [ x[0] for x in by_end ]
+        self.by_end = [ x[2] for x in by_end ]
+
+    def overlapping(self, position):
+        """
+        Return (start, stop, feature) for each feature covering position,
+        in order of start.
+        """
+        i = bisect.bisect_right(self.starts, position) - 1
+        found = []
+        while i >= 0 and self.max_stops[i] > position:
+            if self.stops[i] > position:
+                found.append((self.starts[i], self.stops[i],
+                              self.by_start[i]))
+            i -= 1
+        found.reverse()
+        return found
+
+    def next_after(self, position):
+        "Return the first feature starting after position, or None."
+        i = bisect.bisect_right(self.starts, position)
+        if i < len(self.starts):
+            return self.starts[i] - position, self.by_start[i]
+        return None
+
+    def last_before(self, position):
+        "Return the last feature ending before position, or None."
+        i = bisect.bisect_left(self.lasts, position) - 1
+        if i >= 0:
+            return position - self.lasts[i], self.by_end[i]
+        return None
+
+class NearestFeatureIndex:
+    """
+    An index for finding the feature nearest to a position, built once
+    from an AnnotationDB (or any collection of annotations).
+
+    Each sequence's features are kept sorted by start and by end, so
+    that each lookup is a binary search rather than a series of
+    widening NLMSA queries.  `nearest` gives the same answers as
+    `find_nearest_feature`; `upstream` and `downstream` only look at
+    features on one strand.
+    """
+    def __init__(self, annot_db):
+        by_seq = {}
+        by_strand = {}
+        for feature in annot_db.values():
+            seq_id, start, stop, strand = _feature_coords(feature)
+            by_seq.setdefault(seq_id, []).append((start, stop, feature))
+            by_strand.setdefault((seq_id, strand), []).append((start, stop,
+                                                               feature))
+
+        self.by_seq = dict([ (k, _SortedFeatures(v)) for (k, v) in \
+                             by_seq.items() ])
+        self.by_strand = dict([ (k, _SortedFeatures(v)) for (k, v) in \
+                                by_strand.items() ])
+
+    def nearest(self, seq_id, position):
+        """
+        Return the feature nearest to position on the sequence 'seq_id':
+        the shortest feature covering the position, if any (the earliest
+        starting of those, on a tie), or else the one with the closest
+        end.  Returns None if there are no features.
+        """
+        features = self.by_seq.get(seq_id)
+        if features is None:
+            return None
+
+        overlapping = features.overlapping(position)
+        if overlapping:
+            overlapping.sort(key=lambda x: x[1] - x[0])
+            return overlapping[0][2]
+
+        candidates = [ x for x in (features.last_before(position),
+                                   features.next_after(position)) if x ]
+        if not candidates:
+            return None
+
+        candidates.sort(key=lambda x: x[0])
+        return candidates[0][1]
+
+    def nearest_many(self, seq_id, positions):
+        """
+        Find the nearest feature for many positions, or (start, stop)
+        intervals, on the sequence 'seq_id' at once.  'positions' can be
+        a list or a numpy array; each element is either a position or a
+        pair of coordinates, such as a tuple, list or array row.
+
+        The queries are sorted and swept along the sorted features, so
+        the whole batch costs one sort plus a linear pass.  Returns three
+        lists, in the same order as 'positions':
+
+         - the nearest feature (None if there are no features);
+         - the distance to it (0 if it overlaps the query);
+         - where the query lies relative to the feature, taking the
+           feature's strand into account: -1 upstream, 1 downstream,
+           0 overlapping.
+        """
+        n = len(positions)
+        nearest = [None] * n
+        distances = [None] * n
+        sides = [None] * n
+
+        features = self.by_seq.get(seq_id)
+        if features is None or not n:
+            return nearest, distances, sides
+
+        queries = []
+        for pos in positions:
+            try:
+                (start, stop) = pos
+            except TypeError:
+                (start, stop) = (pos, pos + 1)
+            queries.append((int(start), int(stop)))
+
+        # for each query, find the first feature starting at or after its
+        # end (sweeping in order of query end)...
+        next_i = [None] * n
+        i = 0
+        for q in sorted(range(n), key=lambda q: queries[q][1]):
+            qstop = queries[q][1]
+            while i < len(features.starts) and features.starts[i] < qstop:
+                i += 1
+            next_i[q] = i
+
+        # ...and the last feature ending at or before its start (sweeping
+        # in order of query start).
+        prev_i = [None] * n
+        k = 0
+        for q in sorted(range(n), key=lambda q: queries[q][0]):
+            qstart = queries[q][0]
+            while k < len(features.lasts) and features.lasts[k] < qstart:
+                k += 1
+            prev_i[q] = k - 1
+
+        for q in range(n):
+            qstart, qstop = queries[q]
+
+            # anything overlapping?  the features starting before the end
+            # of the query are features.by_start[:next_i[q]].
+            i = next_i[q] - 1
+            if i >= 0 and features.max_stops[i] > qstart:
+                best = None
+                while i >= 0 and features.max_stops[i] > qstart:
+                    length = features.stops[i] - features.starts[i]
+                    if features.stops[i] > qstart and \
+                           (best is None or length <= best[0]):
+                        best = (length, features.by_start[i])
+                    i -= 1
+
+                nearest[q], distances[q], sides[q] = best[1], 0, 0
+                continue
+
+            candidates = []
+            k = prev_i[q]
+            if k >= 0:
+                candidates.append((qstart - features.lasts[k], 1,
+                                   features.by_end[k]))
+            i = next_i[q]
+            if i < len(features.starts):
+                candidates.append((features.starts[i] - (qstop - 1), -1,
+                                   features.by_start[i]))
+
+            candidates.sort(key=lambda x: x[0])
+            distance, direction, feature = candidates[0]
+
+            # direction is 1 if the query lies after the feature on the
+            # forward strand; flip it for reverse strand features.
+            strand = _feature_coords(feature)[3]
+            nearest[q], distances[q], sides[q] = feature, distance, \
+                                                 direction * strand
+
+        return nearest, distances, sides
+
+    def downstream(self, seq_id, position, strand=1):
+        """
+        Return the nearest feature on the given strand (1 or -1) lying
+        entirely downstream of position, in that strand's direction.
+        """
+        features = self.by_strand.get((seq_id, strand))
+        if features is None:
+            return None
+
+        if strand == 1:
+            found = features.next_after(position)
+        else:
+            found = features.last_before(position)
+        return found and found[1]
+
+    def upstream(self, seq_id, position, strand=1):
+        """
+        Return the nearest feature on the given strand (1 or -1) lying
+        entirely upstream of position, in that strand's direction.
+        """
+        features = self.by_strand.get((seq_id, strand))
+        if features is None:
+            return None
+
+        if strand == 1:
+            found = features.last_before(position)
+        else:
+            found = features.next_after(position)
+        return found and found[1]
+
 def test():
+    import random
+    import numpy
 
     NAME='test'
+    OVERLAPS='overlaps'
     SPACING=5000
 
     class Spot:
-        def __init__(self, name, start, stop):
-            self.id = NAME
+        def __init__(self, name, start, stop, id=NAME):
+            self.id = id
             self.name = name
             self.start = int(start)
             self.stop = int(stop)
@@ -58,6 +296,20 @@ def test():
         spot = Spot(str(i), i, i+100)
         annot_d[str(i)] = spot
 
+    # lots of overlapping features, many of the same length, on a second
+    # sequence.
+    seq_dict[OVERLAPS] = sequence.Sequence('A'*10000, OVERLAPS)
+    random.seed(1)
+    starts = []
+    for i in range(300):
+        if starts and i % 10 == 0:
+            start = random.choice(starts)
+        else:
+            start = random.randrange(0, 9900)
+        starts.append(start)
+        stop = start + random.choice((10, 20, 50))
+        annot_d['o%d' % i] = Spot('o%d' % i, start, stop, OVERLAPS)
+
     annot_db = seqdb.AnnotationDB(annot_d, seq_dict)
     annot_map = cnestedlist.NLMSA('spots', mode='memory', pairwiseMode=True)
 
@@ -78,5 +330,32 @@ def test():
     assert find_nearest_feature(annot_map, s, 2651).sequence.start == 5000
     assert find_nearest_feature(annot_map, s, 2600).sequence.start == 5000
 
+    index = NearestFeatureIndex(annot_db)
+    for pos in (0, 5, 100, 2000, 2549, 2550, 2651, 2600, 4999999):
+        a = find_nearest_feature(annot_map, s, pos)
+        b = index.nearest(NAME, pos)
+        assert a.sequence.start == b.sequence.start, pos
+
+    positions = [0, 5, 100, 2000, 2549, 2550, 2651, 2600]
+    features, distances, sides = index.nearest_many(NAME, positions)
+    assert [ f.sequence.start for f in features ] == \
+           [ index.nearest(NAME, pos).sequence.start for pos in positions ]
+    assert distances == [0, 0, 1, 1901, 2450, 2450, 2349, 2400]
+    assert sides == [0, 0, 1, 1, 1, -1, -1, -1]
+
+    positions = range(0, 10000, 7)
+    features = index.nearest_many(OVERLAPS, positions)[0]
+    assert features == [ index.nearest(OVERLAPS, pos) for pos in positions ]
+
+    intervals = [ (pos, pos + 5) for pos in positions ]
+    expected = index.nearest_many(OVERLAPS, intervals)
+    assert index.nearest_many(OVERLAPS, map(list, intervals)) == expected
+    assert index.nearest_many(OVERLAPS, numpy.array(intervals)) == expected
+    assert index.nearest_many(OVERLAPS, numpy.array(positions))[0] == features
+
+    assert index.downstream(NAME, 2000).sequence.start == 5000
+    assert index.upstream(NAME, 2000).sequence.start == 0
+    assert index.downstream(NAME, 2000, -1) is None
+
 if __name__ == '__main__':
     test()
@@ -0,0 +1,272 @@
+"""
+A persistent, memory-mapped store of motif search results.
+
+Searching a genome with `motility.find_iupac`, `pwm.find` or an energy
+operator is the slow part of most of the tutorials, and the results only
+ever live in memory as lists of tuples.  A `HitStore` saves the hits for
+each (genome, sequence id, motif, threshold) combination to a file of
+fixed-width binary records sorted by start, and reopens them with mmap:
+
+   >>> store = HitStore('hits/')
+   >>> find = lambda s: dorsal_pwm.find(s, threshold)
+   >>> scan = lambda: pygr_scan.scan_sequence(find, d_mel['chr2L'],
+   ...                                        len(dorsal_pwm))
+   >>> hits = store.get_or_scan('dm3', 'chr2L', dorsal_pwm, threshold,
+   ...                          scan, score=dorsal_pwm.calc_score)
+
+The `HitFile` that comes back acts like a read-only list of
+(start, stop, orientation, score) tuples, so it can be handed straight
+to `pygr_motif.MatchMap` or `pygr_cluster.find_clusters`; `query()`
+pulls out just the hits overlapping a range of coordinates.
+"""
+import os
+import bisect
+import mmap
+import struct
+import string
+from hashlib import sha1
+
+MAGIC = 'MOTIFHITS1\n'
+HEADER = struct.Struct('<%dsqq' % (len(MAGIC),))  # magic, count, max length
+RECORD = struct.Struct('<iidb3x')                 # start, stop, score, orient
+
+_COMPLEMENT = string.maketrans('ACGTRYKMBDHVNacgtrykmbdhvn',
+                                'TGCAYRMKVHDBNtgcayrmkvhdbn')
+
+def reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+def motif_fingerprint(motif):
+    """
+    Return a string identifying a motif: an IUPAC string, or a matrix given
+    as a sequence of rows or an object (like a motility PWM) with a
+    'matrix' attribute.
+    """
+    if isinstance(motif, str):
+        return 'iupac:' + motif
+
+    matrix = getattr(motif, 'matrix', motif)
+    try:
+        rows = [ list(row) for row in matrix ]
+    except TypeError:
+        raise TypeError("can't fingerprint motif %r" % (motif,))
+    return 'matrix:' + repr(rows)
+
+def write_hits(filename, hits, score=None):
+    """
+    Write motility-style (start, stop, orientation, match) tuples to a
+    hit file, sorted by start.
+
+    The motility finders return the matched sequence as the fourth
+    element; pass a 'score' function (e.g. pwm.calc_score) to turn it
+    into the score that's stored.  The match is always given on the
+    forward strand, so for orientation -1 hits it's reverse complemented
+    before scoring.  Without a 'score' function, the fourth element must
+    already be a number.
+    """
+    hits = sorted(hits)
+    max_len = max([ stop - start for (start, stop, _, _) in hits ] or [0])
+
+    tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+    fp = open(tmp_filename, 'wb')
+    try:
+        fp.write(HEADER.pack(MAGIC, len(hits), max_len))
+        for hit in hits:
+            (start, stop, orient, match) = hit[:4]
+            if score is not None:
+                if orient == -1:
+                    match = reverse_complement(match)
+                match = score(match)
+            if not isinstance(match, (int, long, float)):
+                raise ValueError("hit %r has no numeric score; pass a "
+                                 "'score' function" % (hit,))
+            fp.write(RECORD.pack(start, stop, match, orient))
+    except:
+        fp.close()
+        os.unlink(tmp_filename)
+        raise
+    fp.close()
+    os.rename(tmp_filename, filename)
+
+#
+# HitFile
+#
+
+class HitFile:
+    """
+    A memory-mapped, read-only hit file; acts like a list of
+    (start, stop, orientation, score) tuples sorted by start.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+        fp = open(filename, 'rb')
+        try:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fp.close()
+
+        (magic, self._count, self.max_len) = \
+                HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError("%s is not a hit file" % (filename,))
+
+        self._starts = _StartColumn(self)
+
+    def close(self):
+        self._mmap.close()
+
+    def __len__(self):
+        return self._count
+
+    def _record(self, i):
+        (start, stop, score, orient) = \
+                RECORD.unpack_from(self._mmap, HEADER.size + i * RECORD.size)
+        return (start, stop, orient, score)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self._record(j) for j in range(*i.indices(len(self))) ]
+
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        return self._record(i)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self._record(i)
+
+    def query(self, start, stop):
+        """
+        Return the hits overlapping [start:stop], sorted by start.
+        """
+        # nothing starting more than max_len before 'start' can reach it.
+        i = bisect.bisect_left(self._starts, start - self.max_len + 1)
+
+        results = []
+        while i < len(self):
+            hit = self._record(i)
+            if hit[0] >= stop:
+                break
+            if hit[1] > start:
+                results.append(hit)
+            i += 1
+
+        return results
+
+class _StartColumn:
+    """
+    A view of the start positions of a HitFile, for bisect.
+    """
+    def __init__(self, hit_file):
+        self.hit_file = hit_file
+
+    def __len__(self):
+        return len(self.hit_file)
+
+    def __getitem__(self, i):
+        return RECORD.unpack_from(self.hit_file._mmap,
+                                  HEADER.size + i * RECORD.size)[0]
+
+#
+# HitStore
+#
+
+class HitStore:
+    """
+    A directory of hit files, one per (genome, sequence id, motif,
+    threshold).
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _filename(self, genome, seq_id, motif, threshold):
+        key = repr((genome, seq_id, motif_fingerprint(motif), threshold))
+        return os.path.join(self.directory, sha1(key).hexdigest() + '.hits')
+
+    def has(self, genome, seq_id, motif, threshold):
+        return os.path.exists(self._filename(genome, seq_id, motif,
+                                             threshold))
+
+    def put(self, genome, seq_id, motif, threshold, hits, score=None):
+        """
+        Save the hits for the given search; see `write_hits`.
+        """
+        write_hits(self._filename(genome, seq_id, motif, threshold), hits,
+                   score)
+
+    def get(self, genome, seq_id, motif, threshold):
+        """
+        Return a HitFile for the given search, or None if it's not stored.
+        """
+        filename = self._filename(genome, seq_id, motif, threshold)
+        if not os.path.exists(filename):
+            return None
+        return HitFile(filename)
+
+    def get_or_scan(self, genome, seq_id, motif, threshold, scan,
+                    score=None):
+        """
+        Return a HitFile for the given search, calling scan() to run the
+        search (and saving the results) if it's not stored yet.
+        """
+        hits = self.get(genome, seq_id, motif, threshold)
+        if hits is None:
+            self.put(genome, seq_id, motif, threshold, scan(), score)
+            hits = self.get(genome, seq_id, motif, threshold)
+
+        return hits
+
+#
+# test
+#
+
+def test():
+    import random
+    import shutil
+    import tempfile
+
+    # a score that counts matches to 'GATA'; 'TATC' on the forward strand
+    # is a perfect match on the reverse strand.
+    def score(site):
+        return float(sum([ a == b for (a, b) in zip(site, 'GATA') ]))
+
+    directory = tempfile.mkdtemp()
+    try:
+        store = HitStore(directory)
+        hits = [ (10, 14, 1, 'GATA'), (20, 24, -1, 'TATC'),
+                 (30, 34, -1, 'GATA') ]
+        store.put('g', 'chr', 'GATA', 3.0, hits, score=score)
+        stored = store.get('g', 'chr', 'GATA', 3.0)
+        assert list(stored) == [ (10, 14, 1, 4.0), (20, 24, -1, 4.0),
+                                 (30, 34, -1, 2.0) ]
+        stored.close()
+
+        hits = []
+        for i in range(2000):
+            start = random.randrange(0, 100000)
+            hits.append((start, start + random.randint(5, 12),
+                         random.choice((1, -1)), random.random()))
+        hits.sort()
+
+        store.put('g', 'chr', [[1, 2, 3, 4]], None, hits)
+        stored = store.get('g', 'chr', [[1, 2, 3, 4]], None)
+        assert len(stored) == len(hits)
+        assert [ x[:3] for x in stored ] == [ x[:3] for x in hits ]
+        for i in range(200):
+            start = random.randrange(0, 100000)
+            stop = start + random.randint(1, 500)
+            expected = [ x[:3] for x in hits if x[0] < stop and x[1] > start ]
+            assert [ x[:3] for x in stored.query(start, stop) ] == expected
+        stored.close()
+    finally:
+        shutil.rmtree(directory)
+
+    print 'ok'
+
+if __name__ == '__main__':
+    test()
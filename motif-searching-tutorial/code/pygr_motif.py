@@ -1,3 +1,6 @@
+import bisect
+from array import array
+
 from pygr import seqdb, cnestedlist
 
 class SiteMatch:
@@ -12,8 +15,9 @@ class SiteMatch:
 def map_matches(genome, region, sites, prefix=''):
     d = {}
     for n, (start, stop, orientation, site) in enumerate(sites):
-        n = 'prefix' + str(n)
-        o = SiteMatch(n, region.id, start, stop, orientation)
+        n = prefix + str(n)
+        o = SiteMatch(n, region.id, region.start + start,
+                      region.start + stop, orientation)
         d[n] = o
 
     annodb = seqdb.AnnotationDB(d, genome)
@@ -25,3 +29,187 @@ def map_matches(genome, region, sites, prefix=''):
     map.build()
 
     return map
+
+#
+# MatchMap: a lighter-weight replacement for map_matches.
+#
+
+class MatchAnnotation(SiteMatch):
+    """
+    One motif match, as returned by a MatchMap query.  'sequence' is the
+    part of the match that overlaps the query, on the match's strand.
+    """
+    def __init__(self, name, id, start, stop, orientation, match,
+                 sequence):
+        SiteMatch.__init__(self, name, id, start, stop, orientation)
+        self.orientation = orientation
+        self.match = match
+        self.sequence = sequence
+
+class _MatchMapSlice:
+    """
+    The matches overlapping one query interval of a MatchMap.
+    """
+    def __init__(self, match_map, indices, qstart, qstop):
+        self.match_map = match_map
+        self.indices = indices
+        self.qstart = qstart
+        self.qstop = qstop
+
+    def keys(self, minAlignSize=None):
+        """
+        Return a MatchAnnotation for each overlapping match, optionally
+        only those overlapping the query by at least minAlignSize bases.
+        """
+        return [ self.match_map._make_annotation(i, self.qstart, self.qstop)
+                 for i in self._overlaps(minAlignSize) ]
+
+    def _overlaps(self, minAlignSize):
+        m = self.match_map
+        for i in self.indices:
+            overlap = min(m.stops[i], self.qstop) - \
+                      max(m.starts[i], self.qstart)
+            if minAlignSize is None or overlap >= minAlignSize:
+                yield i
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+class MatchMap(object):
+    """
+    A map of motif matches onto a sequence, for retrieving matches by
+    position: `match_map[region].keys()` works like the NLMSA returned by
+    `map_matches`.
+
+    The matches are kept as parallel arrays of starts, stops and
+    orientations, sorted by start, along with the running maximum of the
+    stops; annotation objects are only built for the matches a query
+    returns.
+
+    Create by calling `MatchMap(genome, region, sites)`, where 'sites' is
+    a list of motility-style (start, stop, orientation, match) tuples
+    relative to 'region', or with `MatchMap.from_arrays`.
+    """
+    def __init__(self, genome, region, sites, prefix=''):
+        starts = [ start for (start, stop, orientation, match) in sites ]
+        stops = [ stop for (start, stop, orientation, match) in sites ]
+        orients = [ orientation for (start, stop, orientation, match) \
+                    in sites ]
+        matches = [ match for (start, stop, orientation, match) in sites ]
+
+        self._init(genome, region.id, region.start, starts, stops, orients,
+                   matches, prefix)
+
+    @classmethod
+    def from_arrays(cls, genome, region, starts, stops, orients,
+                    matches=None, prefix=''):
+        """
+        Build a MatchMap from parallel sequences of starts, stops and
+        orientations (and, optionally, the matched sequences).
+        """
+        self = cls.__new__(cls)
+        self._init(genome, region.id, region.start, starts, stops, orients,
+                   matches, prefix)
+        return self
+
+    def _init(self, genome, seq_id, offset, starts, stops, orients, matches,
+              prefix):
+        assert len(starts) == len(stops) == len(orients)
+
+        self.genome = genome
+        self.seq_id = seq_id
+        self.prefix = prefix
+
+        order = range(len(starts))
+        order.sort(key=lambda i: (starts[i], stops[i]))
+
+        self.order = array('l', order)
+        self.starts = array('l', [ starts[i] + offset for i in order ])
+        self.stops = array('l', [ stops[i] + offset for i in order ])
+        self.orients = array('b', [ orients[i] for i in order ])
+        self.matches = matches
+
+        self.max_stops = array('l')
+        for stop in self.stops:
+            if self.max_stops:
+                stop = max(stop, self.max_stops[-1])
+            self.max_stops.append(stop)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _make_annotation(self, i, qstart, qstop):
+        start, stop, orient = self.starts[i], self.stops[i], self.orients[i]
+        n = self.order[i]
+
+        match = None
+        if self.matches is not None:
+            match = self.matches[n]
+
+        sequence = self.genome[self.seq_id][max(start, qstart):
+                                            min(stop, qstop)]
+        if orient == -1:
+            sequence = -sequence
+
+        return MatchAnnotation(self.prefix + str(n), self.seq_id, start, stop,
+                               orient, match, sequence)
+
+    def __getitem__(self, ival):
+        """
+        Return the matches overlapping the sequence interval 'ival'.
+        """
+        if ival.id != self.seq_id:
+            return _MatchMapSlice(self, [], 0, 0)
+
+        qstart, qstop = ival.start, ival.stop
+        if qstart < 0:                  # reverse strand
+            qstart, qstop = -qstop, -qstart
+
+        # walk back over matches starting before the end of the query;
+        # once the running max stop falls short of its start, nothing
+        # further back can overlap.
+        i = bisect.bisect_left(self.starts, qstop) - 1
+        indices = []
+        while i >= 0 and self.max_stops[i] > qstart:
+            if self.stops[i] > qstart:
+                indices.append(i)
+            i -= 1
+        indices.reverse()
+
+        return _MatchMapSlice(self, indices, qstart, qstop)
+
+def test():
+    import random
+    from pygr import sequence
+
+    seq = sequence.Sequence('ACGT' * 2500, 'test')
+    genome = { 'test' : seq }
+    region = seq[1000:9000]
+
+    sites = []
+    for i in range(200):
+        start = random.randrange(0, 7980)
+        stop = start + random.randint(5, 20)
+        sites.append((start, stop, random.choice((1, -1)), 'site%d' % i))
+
+    a = MatchMap(genome, region, sites, prefix='m')
+    b = MatchMap.from_arrays(genome, region,
+                             [ x[0] for x in sites ], [ x[1] for x in sites ],
+                             [ x[2] for x in sites ], [ x[3] for x in sites ],
+                             prefix='m')
+
+    def describe(match_map, ival):
+        return [ (m.name, m.id, m.start, m.stop, m.orientation, m.match,
+                  str(m.sequence)) for m in match_map[ival].keys() ]
+
+    for i in range(100):
+        start = random.randrange(0, 9900)
+        ival = seq[start:start + random.randint(1, 100)]
+        assert describe(a, ival) == describe(b, ival)
+        assert describe(a, -ival) == describe(b, -ival)
+
+if __name__ == '__main__':
+    test()
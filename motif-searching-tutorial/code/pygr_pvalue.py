@@ -0,0 +1,174 @@
+"""
+Exact score distributions for PWMs and energy matrices.
+
+motility's `generate_sites_over` and `weight_sites_over` work by
+enumerating sites, which is fine for a 6-mer but hopeless for a 20-30 bp
+matrix (4^N sites).  Instead, `ScoreDistribution` rounds the matrix
+weights onto a grid of width 'step' and builds the distribution of site
+scores under a random background one position at a time -- N
+convolutions over the score bins -- so p-values and thresholds come back
+instantly:
+
+   >>> dist = ScoreDistribution(dorsal_matrix)
+   >>> dist.pvalue(45)                      # cf. weight_sites_over(45)
+   >>> dist.threshold_for_rate(100)         # ~100 random matches per Mbp
+
+Because of the rounding, scores are only exact to within
+N * step / 2; make 'step' smaller if that matters.
+"""
+import numpy
+
+MBP = 1e6
+
+def background_probs(gc=0.5):
+    """
+    Return the probabilities of A, C, G and T in a random sequence with the
+    given GC content.
+    """
+    at = (1. - gc) / 2.
+    gc = gc / 2.
+    return numpy.array([at, gc, gc, at])
+
+#
+# ScoreDistribution
+#
+
+class ScoreDistribution:
+    """
+    The distribution of scores of random sites under a matrix of
+    (A, C, G, T) weights, one row per position.
+
+    By default higher scores are better, as for motility PWMs; set
+    'lower_is_better' for energy matrices, where a site matches if its
+    energy is at or *below* the threshold.
+    """
+    def __init__(self, matrix, gc=0.5, step=0.001, lower_is_better=False):
+        self.lower_is_better = lower_is_better
+        self.step = step
+        self.length = len(matrix)
+
+        weights = numpy.array([ list(row)[:4] for row in matrix ],
+                              dtype=numpy.float64)
+        if lower_is_better:
+            weights = -weights
+
+        # shift each row so that its lowest weight is 0 & round to the grid.
+        row_mins = weights.min(axis=1)
+        self.offset = row_mins.sum()
+        int_weights = numpy.round((weights - row_mins[:, None]) / step)
+        int_weights = int_weights.astype(numpy.int64)
+
+        probs = background_probs(gc)
+
+        dist = numpy.ones(1)
+        for row in int_weights:
+            new_dist = numpy.zeros(len(dist) + row.max())
+            for base in range(4):
+                new_dist[row[base]:row[base] + len(dist)] += probs[base] * dist
+            dist = new_dist
+
+        self.dist = dist
+
+        # tail[k] = probability of a score at or above bin k.
+        self._tail = numpy.append(dist[::-1].cumsum()[::-1], 0.)
+
+    @classmethod
+    def from_binding_matrix(cls, matrix, gc=0.5, step=0.001):
+        """
+        Build the energy distribution for a bndarray.BindingMatrix.
+        """
+        return cls(matrix.table[:, :4], gc, step, lower_is_better=True)
+
+    def _bin(self, threshold):
+        if self.lower_is_better:
+            threshold = -threshold
+        k = numpy.ceil((threshold - self.offset) / self.step - 1e-6)
+        return int(min(max(k, 0), len(self.dist)))
+
+    def _score(self, k):
+        score = self.offset + k * self.step
+        if self.lower_is_better:
+            return -score
+        return score
+
+    def pvalue(self, threshold):
+        """
+        Return the probability that a random site matches at 'threshold';
+        this is the same quantity as motility's weight_sites_over.
+        """
+        return float(self._tail[self._bin(threshold)])
+
+    def threshold_for_pvalue(self, pvalue):
+        """
+        Return the loosest threshold whose p-value is at most 'pvalue'.
+        """
+        # _tail is decreasing, so search its reverse.
+        n = len(self._tail)
+        k = n - numpy.searchsorted(self._tail[::-1], pvalue, side='right')
+        return self._score(k)
+
+    def expected_per_mbp(self, threshold, strands=2):
+        """
+        Return the number of random matches expected per Mbp, searching
+        'strands' strands.
+        """
+        return self.pvalue(threshold) * MBP * strands
+
+    def threshold_for_rate(self, per_mbp, strands=2):
+        """
+        Return the loosest threshold that gives at most 'per_mbp' random
+        matches per Mbp, searching 'strands' strands.
+        """
+        return self.threshold_for_pvalue(per_mbp / MBP / strands)
+
+#
+# test
+#
+
+def test():
+    import random
+    import itertools
+
+    # the example from the motility introduction.
+    third = 1. / 3.
+    matrix = [ (2 * third, 0, 0, third), (0, 0, 1, 0), (1, 0, 0, 0),
+               (0, 0, 0, 1), (1, 0, 0, 0), (2 * third, 0, third, 0) ]
+    assert abs(ScoreDistribution(matrix).pvalue(4.5) - 0.001953125) < 1e-12
+
+    for trial in range(20):
+        length = random.randint(1, 5)
+        matrix = [ [ random.randint(0, 20) * 0.25 for i in range(4) ]
+                   for j in range(length) ]
+        gc = random.random()
+        probs = background_probs(gc)
+
+        sites = []
+        for site in itertools.product(range(4), repeat=length):
+            score = sum([ matrix[i][b] for (i, b) in enumerate(site) ])
+            p = numpy.prod([ probs[b] for b in site ])
+            sites.append((score, p))
+
+        dist = ScoreDistribution(matrix, gc, step=0.25)
+        energies = ScoreDistribution(matrix, gc, step=0.25,
+                                     lower_is_better=True)
+        for threshold in numpy.arange(-1, 5 * length + 1, 0.25):
+            expected = sum([ p for (s, p) in sites if s >= threshold ])
+            assert abs(dist.pvalue(threshold) - expected) < 1e-9
+
+            expected = sum([ p for (s, p) in sites if s <= threshold ])
+            assert abs(energies.pvalue(threshold) - expected) < 1e-9
+
+        for pvalue in (1., 0.5, 0.1, 0.01, 1e-4, 0.):
+            t = dist.threshold_for_pvalue(pvalue)
+            assert dist.pvalue(t) <= pvalue + 1e-12
+            assert dist.pvalue(t - 0.25) > pvalue or t <= dist.offset
+
+            t = energies.threshold_for_pvalue(pvalue)
+            assert energies.pvalue(t) <= pvalue + 1e-12
+            assert energies.pvalue(t + 0.25) > pvalue or \
+                   t >= -energies.offset
+
+    print 'ok'
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,189 @@
+"""
+Scan whole chromosomes for motifs without turning them into strings.
+
+Calling `motility.find_iupac(str(chrom), motif)` or `pwm.find(str(chrom),
+threshold)` pulls the entire chromosome into memory as a single string.
+`scan_sequence` instead reads the sequence a window at a time, with an
+overlap of one motif length between windows, runs the matcher on each
+window, and shifts the hits back into chromosome coordinates.  Each hit
+is reported by exactly one window -- the one its start position falls
+in -- so there are no duplicates at window boundaries.
+
+For example,
+
+   >>> matches = scan_sequence(lambda s: motility.find_iupac(s, 'GCANTGC'),
+   ...                         yeast['chr1'], len('GCANTGC'))
+
+   >>> matches = scan_sequence(lambda s: dorsal_pwm.find(s, threshold),
+   ...                         d_mel['chr2L'], len(dorsal_pwm))
+
+`parallel_scan` does the same for many motifs over a whole genome at once,
+farming the (chromosome, window, motif) combinations out to a pool of
+worker processes.
+"""
+from multiprocessing import Pool
+
+from pygr import seqdb
+
+DEFAULT_WINDOW_SIZE = 1000000
+
+def _window_bounds(seqlen, motif_len, window_size):
+    """
+    Return (start, stop) for each window of a sequence of length 'seqlen';
+    windows overlap by motif_len - 1 so that every site is seen whole.
+    """
+    bounds = []
+    for offset in range(0, max(seqlen - motif_len + 1, 0), window_size):
+        stop = min(offset + window_size + motif_len - 1, seqlen)
+        bounds.append((offset, stop))
+    return bounds
+
+def iter_windows(sequence, motif_len, window_size=DEFAULT_WINDOW_SIZE):
+    """
+    Generate (offset, window) tuples covering 'sequence', where 'window'
+    is str(sequence[offset:offset + window_size + motif_len - 1]).  The
+    sequence can be a pygr sequence or anything else that can be sliced.
+    """
+    for offset, stop in _window_bounds(len(sequence), motif_len,
+                                       window_size):
+        yield offset, str(sequence[offset:stop])
+
+def _scan_window(find, window, offset, window_size):
+    """
+    Run 'find' on one window & return its hits in chromosome coordinates.
+    """
+    results = []
+    for hit in find(window):
+        start, stop = hit[0], hit[1]
+
+        # hits starting past the end of this window's share of the
+        # sequence belong to the next window.
+        if start >= window_size:
+            continue
+
+        results.append((start + offset, stop + offset) + tuple(hit[2:]))
+
+    results.sort()
+    return results
+
+def scan_sequence(find, sequence, motif_len, window_size=DEFAULT_WINDOW_SIZE):
+    """
+    Run 'find' over 'sequence' a window at a time.
+
+    'find' is called with each window as a string and should return
+    motility-style (start, stop, orientation, match) tuples relative to
+    the window.  Returns all of the hits in chromosome coordinates,
+    sorted by position.
+    """
+    results = []
+    for offset, window in iter_windows(sequence, motif_len, window_size):
+        results.extend(_scan_window(find, window, offset, window_size))
+
+    return results
+
+#
+# parallel scanning of whole genomes
+#
+
+def iupac_motif(motif):
+    """
+    Describe an IUPAC motif search for `parallel_scan`.
+    """
+    return ('iupac', motif, None)
+
+def pwm_motif(matrix, threshold):
+    """
+    Describe a PWM search for `parallel_scan`.  'matrix' is the PWM as a
+    list of [A, C, G, T] rows, e.g. as printed for a motility PWM.
+    """
+    return ('pwm', [ list(row) for row in matrix ], threshold)
+
+def energy_motif(operator, threshold):
+    """
+    Describe an energy operator search for `parallel_scan`.  'operator'
+    is a list of [A, C, G, T, N] rows.
+    """
+    return ('energy', [ list(row) for row in operator ], threshold)
+
+def _motif_len(spec):
+    (kind, motif, threshold) = spec
+    return len(motif)
+
+def _make_finder(spec):
+    import motility                     # only needed for parallel_scan
+
+    (kind, motif, threshold) = spec
+    if kind == 'iupac':
+        return lambda s: motility.find_iupac(s, motif)
+    elif kind == 'pwm':
+        pwm = motility.PWM(motif)
+        return lambda s: pwm.find(s, threshold)
+    elif kind == 'energy':
+        operator = motility.EnergyOperator(motif)
+        return lambda s: operator.find(s, threshold)
+
+    raise ValueError("unknown motif type %r" % (kind,))
+
+# each worker process opens the genome (and builds each motif) only once.
+_worker_genomes = {}
+_worker_finders = {}
+
+def _scan_task(task):
+    (name, spec, genome_path, seq_id, offset, stop, window_size) = task
+
+    genome = _worker_genomes.get(genome_path)
+    if genome is None:
+        genome = _worker_genomes[genome_path] = seqdb.BlastDB(genome_path)
+
+    find = _worker_finders.get(name)
+    if find is None:
+        find = _worker_finders[name] = _make_finder(spec)
+
+    window = str(genome[seq_id][offset:stop])
+
+    return name, seq_id, _scan_window(find, window, offset, window_size)
+
+def parallel_scan(genome_path, motifs, seq_ids=None, processes=None,
+                  window_size=DEFAULT_WINDOW_SIZE):
+    """
+    Search the genome in the FASTA file 'genome_path' (loaded with
+    seqdb.BlastDB) for several motifs at once, using a pool of
+    'processes' workers (default: one per CPU).
+
+    'motifs' is a dictionary mapping a name to a motif description from
+    `iupac_motif`, `pwm_motif` or `energy_motif`.  'seq_ids' restricts
+    the search to the given chromosomes.
+
+    Returns a dictionary mapping each motif name to a dictionary of
+    chromosome name -> sorted list of (start, stop, orientation, match).
+    """
+    genome = seqdb.BlastDB(genome_path)
+    if seq_ids is None:
+        seq_ids = list(genome)
+
+    results = {}
+    tasks = []
+    for name, spec in motifs.items():
+        results[name] = {}
+        motif_len = _motif_len(spec)
+
+        for seq_id in seq_ids:
+            results[name][seq_id] = []
+            seqlen = len(genome[seq_id])
+            for offset, stop in _window_bounds(seqlen, motif_len,
+                                               window_size):
+                tasks.append((name, spec, genome_path, seq_id, offset, stop,
+                              window_size))
+
+    # the tasks for each (motif, chromosome) are in window order, and imap
+    # returns results in task order, so the merged hit lists come out
+    # sorted.
+    pool = Pool(processes)
+    try:
+        for name, seq_id, hits in pool.imap(_scan_task, tasks):
+            results[name][seq_id].extend(hits)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
@@ -7,6 +7,79 @@ for dealing with similar stuff in a particular format.
 import sys
 from biolib import fasta
 
+import numpy
+
+#
+# encode_sites
+#
+
+# map A/C/G/T (either case) to 0-3, and everything else (N etc.) to 4.
+_ENCODE_TABLE = ['\x04'] * 256
+for _i, _base in enumerate('ACGT'):
+    _ENCODE_TABLE[ord(_base)] = _ENCODE_TABLE[ord(_base.lower())] = chr(_i)
+_ENCODE_TABLE = ''.join(_ENCODE_TABLE)
+
+N_CODE = 4
+
+_CONV = { 'A' : 0, 'C' : 1, 'G' : 2, 'T' : 3 }
+
+def encode_sequence(seq):
+    """
+    Convert a DNA string into a uint8 array of base codes: A=0, C=1, G=2,
+    T=3, anything else=4.  Lowercase is treated like uppercase.
+    """
+    return numpy.frombuffer(str(seq).translate(_ENCODE_TABLE),
+                            dtype=numpy.uint8)
+
+def encode_sites(sites, length=None):
+    """
+    Convert a list of equal-length sites into an (N x length) uint8 array
+    of base codes; see `encode_sequence`.  If 'length' is given, the sites
+    must be that long, and an empty list gives a (0 x length) array.
+    """
+    if not len(sites):
+        return numpy.zeros((0, length or 0), dtype=numpy.uint8)
+
+    if length is None:
+        length = len(sites[0])
+    for site in sites:
+        assert len(site) == length, site
+
+    return encode_sequence(''.join(sites)).reshape(len(sites), length)
+
+#
+# find_in_windows
+#
+
+def find_in_windows(find, seq, length, chunk_size=1000000):
+    """
+    Run the motif finder 'find' over the sequence 'seq' (a string or a
+    pygr sequence) 'chunk_size' bases at a time, instead of calling it on
+    str(seq).
+
+    'find' is called with each chunk as a string & should return
+    motility-style (start, stop, orientation, ...) tuples relative to the
+    chunk.  Chunks overlap by length - 1 so that every site is seen, and
+    each site is only reported by the chunk that its start falls in.
+
+    Returns all of the matches in sequence coordinates, sorted by start.
+    """
+    seqlen = len(seq)
+    results = []
+    for chunk_start in range(0, max(seqlen - length + 1, 0), chunk_size):
+        chunk_stop = min(chunk_start + chunk_size + length - 1, seqlen)
+
+        for match in find(str(seq[chunk_start:chunk_stop])):
+            start, stop = match[0], match[1]
+            if start >= chunk_size:     # belongs to the next chunk.
+                continue
+
+            results.append((start + chunk_start, stop + chunk_start) +
+                           tuple(match[2:]))
+
+    results.sort()
+    return results
+
 #
 # BindingMatrix
 #
@@ -15,28 +88,146 @@ class BindingMatrix:
     """
     A class to hold a representation of a binding matrix.
     """
-    def __init__(self, length, arr):
+    def __init__(self, length, arr, n_energy=1000.):
         "Initialize."
         self.length = int(length)
         assert len(arr) == self.length
         self.arr = arr
+        self.n_energy = n_energy
+
+        # the matrix as a (length x 5) array with a column for 'N', and
+        # the same for the reverse complement of the site.
+        table = numpy.empty((self.length, 5), dtype=numpy.float64)
+        table[:, :4] = numpy.asarray(arr, dtype=numpy.float64).reshape(-1, 4)
+        table[:, 4] = n_energy
+        self.table = table
+        self.rc_table = table[::-1, [3, 2, 1, 0, 4]].copy()
 
     def match_energy(self, site):
         "Calculate the match of the site under this matrix."
         
         assert len(site) == self.length
 
-        conv = { 'A' : 0, 'C' : 1, 'G' : 2, 'T' : 3 }
-
         total = 0.
         for i in range(0, self.length):
             base = site[i]
-            base_i = conv[base]
+            base_i = _CONV[base]
             strength = (self.arr[i])[base_i]
             total += strength
 
         return total
 
+    def match_energies(self, sites, reverse=False):
+        """
+        Calculate the match of many sites at once.  'sites' is either a
+        list of strings or an (N x length) code array from `encode_sites`.
+        Sites containing an 'N' get an energy of at least n_energy.
+
+        If 'reverse' is True, also return the energies of the reverse
+        complements of the sites.
+        """
+        codes = sites
+        if not isinstance(codes, numpy.ndarray):
+            codes = encode_sites(sites, self.length)
+        assert codes.shape[1:] == (self.length,)
+
+        positions = numpy.arange(self.length)
+        energies = self.table[positions, codes].sum(axis=1)
+        if not reverse:
+            return energies
+
+        rc_energies = self.rc_table[positions, codes].sum(axis=1)
+        return energies, rc_energies
+
+    def scan_energies(self, seq):
+        """
+        Calculate the match of every site in the sequence 'seq' (a string
+        or a code array from `encode_sequence`), on both strands.
+
+        Returns two arrays, 'forward' and 'reverse', where forward[i] and
+        reverse[i] are the energies of seq[i:i+length] and of its reverse
+        complement.
+        """
+        codes = seq
+        if not isinstance(codes, numpy.ndarray):
+            codes = encode_sequence(seq)
+
+        n = len(codes) - self.length + 1
+        forward = numpy.zeros(max(n, 0), dtype=numpy.float64)
+        reverse = numpy.zeros(max(n, 0), dtype=numpy.float64)
+        if n <= 0:
+            return forward, reverse
+
+        for i in range(self.length):
+            window = codes[i:i + n]
+            forward += self.table[i][window]
+            reverse += self.rc_table[i][window]
+
+        return forward, reverse
+
+    def _scan_with_pruning(self, codes, table, threshold):
+        """
+        Find all windows in the code array whose energy under 'table' is
+        at or below the threshold.  Returns arrays of window starts and
+        energies.
+
+        Positions are added in one at a time, most selective first; after
+        each, any window that can't get under the threshold even with
+        the best possible bases at the remaining positions is dropped.
+        """
+        n = len(codes) - self.length + 1
+        if n <= 0:
+            return numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+
+        row_min = table.min(axis=1)
+        order = numpy.argsort(row_min - table[:, :4].max(axis=1))
+
+        # best achievable energy from the positions not yet visited.
+        remaining = numpy.zeros(self.length + 1)
+        remaining[:-1] = numpy.cumsum(row_min[order][::-1])[::-1]
+
+        starts = numpy.arange(n)
+        energies = numpy.zeros(n)
+        for k, i in enumerate(order):
+            energies += table[i][codes[starts + i]]
+
+            keep = energies + remaining[k + 1] <= threshold
+            starts = starts[keep]
+            energies = energies[keep]
+            if not len(starts):
+                break
+
+        return starts, energies
+
+    def _find_in_string(self, seq, threshold):
+        codes = encode_sequence(seq)
+
+        results = []
+        for orient, table in ((1, self.table), (-1, self.rc_table)):
+            starts, energies = self._scan_with_pruning(codes, table,
+                                                       threshold)
+            results.extend([ (start, start + self.length, orient, energy)
+                             for (start, energy) in
+                             zip(starts.tolist(), energies.tolist()) ])
+
+        return results
+
+    def find(self, seq, threshold, chunk_size=1000000):
+        """
+        Find all sites in 'seq' on either strand with an energy at or below
+        the threshold -- a pure Python/numpy stand-in for
+        motility.EnergyOperator.find.
+
+        'seq' can be a string or a pygr sequence; it's scanned with
+        `find_in_windows`, so whole chromosomes needn't be converted into
+        strings.
+
+        Returns a list of (start, stop, orientation, energy) tuples, sorted
+        by start.
+        """
+        find = lambda s: self._find_in_string(s, threshold)
+        return find_in_windows(find, seq, self.length, chunk_size)
+
     def get_as_motility_operator(self):
         """
         Tack on a 1000 for an 'N' match.  The resulting operator
@@ -88,3 +279,29 @@ def parse_as_motility_operator(fp):
         arr.append((A, C, G, T, 1000.))
 
     return arr
+
+#
+# benchmark
+#
+
+def benchmark(matrix, threshold, genome_size=5000000):
+    """
+    Time BindingMatrix.find on a random genome of the given size.
+    """
+    import random
+    import time
+
+    genome = ''.join([ random.choice('ACGT') for i in xrange(genome_size) ])
+
+    t0 = time.time()
+    results = matrix.find(genome, threshold)
+    elapsed = time.time() - t0
+
+    print '%d matches in %.1f Mbp in %.2f s: %.2f Mbp/s' % \
+          (len(results), genome_size / 1e6, elapsed,
+           genome_size / 1e6 / elapsed)
+
+if __name__ == '__main__':
+    matrix = parse_bndarray(open(sys.argv[1]))
+    threshold = float(sys.argv[2])
+    benchmark(matrix, threshold)
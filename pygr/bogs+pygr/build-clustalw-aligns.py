@@ -1,5 +1,7 @@
-#! /usr/bin/env python2.5
+#! /usr/bin/env python2.6
 import os
+from optparse import OptionParser
+from multiprocessing import Pool
 
 # pygr imports
 from pygr import cnestedlist
@@ -7,28 +9,40 @@ import pygr.seqdb
 
 # PTT file utilities for NCBI annotation files
 import cogs2
+from intergenic_batch import get_intergenic_intervals
 
 # import clustalw utilities, too
 from clustalw_utils import *
 
-### a utility function to get only "interesting" (named, with length)
-### intergenic regions from the PTT file.
+# bulk NLMSA loading
+import nlmsa_bulk
 
-def get_intergenic_intervals(ptt_info):
-    intergenic = cogs2.IntergenicRegionsByFootprint(ptt_info)
+### a worker function for the process pool: align one pair of intergenic
+### regions.
 
-    interval_dict = {}
-    for (start, end, name) in intergenic:
-        if '-' in name:
-            continue
+def align_pair(args):
+    key, top, bot = args
+    if cache is not None:
+        a, b = cache.run_pair_clustalw(top, bot)
+    else:
+        a, b = run_pair_clustalw(top, bot)
+    return key, a, b
 
-        key = tuple(name)
-        if end - start > 0:
-            interval_dict[key] = (start, end) # @CTB check end!
+###
 
-    return interval_dict
+parser = OptionParser()
+parser.add_option('-j', '--processes', dest='processes', type='int',
+                  default=1, help='number of clustalw worker processes')
+parser.add_option('-n', '--limit', dest='limit', type='int', default=None,
+                  help='only align the first LIMIT intergenic regions')
+parser.add_option('-c', '--cache', dest='cache_dir', default=None,
+                  help='reuse alignments cached in CACHE_DIR')
+(options, args) = parser.parse_args()
 
-###
+# set up the alignment cache, if requested, before any workers are forked.
+cache = None
+if options.cache_dir:
+    cache = ClustalwCache(options.cache_dir)
 
 ## get the two genomes; build abspath to DNA db.
 
@@ -53,6 +67,12 @@ salm_dict = get_intergenic_intervals(salm_info)
 common_keys = set(ecoli_dict.keys())
 common_keys.intersection_update(salm_dict.keys())
 
+# sort the keys so that the alignment is built in the same order no
+# matter how many worker processes we use.
+common_keys = sorted(common_keys)
+if options.limit is not None:
+    common_keys = common_keys[:options.limit]
+
 #
 # create the NLMSA object to hold the alignments.  Note that use_virtual_lpo
 # will be automatically set to True (because this is a true pairwise
@@ -67,11 +87,41 @@ alignment = cnestedlist.NLMSA('pairbac', mode='w', seqDict=bothdb,
 alignment += ecoli_genome
 
 #
-# iterate over all intergenic regions in common, build clustalw alignments,
-# and save into NLMSA.
+# build the list of jobs: one (key, ecoli sequence, salm sequence) tuple
+# per intergenic region in common.  Sequences are passed as strings so
+# that they can be shipped off to the worker processes.
+#
+
+def iter_jobs():
+    for key in common_keys:
+        ecoli_start, ecoli_stop = ecoli_dict[key]
+        salm_start, salm_stop = salm_dict[key]
+
+        ecoli_ival = ecoli_genome[ecoli_start:ecoli_stop]
+        salm_ival = salm_genome[salm_start:salm_stop]
+
+        yield key, str(ecoli_ival), str(salm_ival)
+
+#
+# run clustalw on all intergenic regions in common, either serially or
+# in a pool of worker processes.  imap hands back the results in job
+# order, so the NLMSA is loaded deterministically either way.
 #
 
-for n, key in enumerate(common_keys):
+if options.processes > 1:
+    pool = Pool(options.processes)
+    results = pool.imap(align_pair, iter_jobs(), chunksize=4)
+else:
+    pool = None
+    results = (align_pair(job) for job in iter_jobs())
+
+#
+# build list of aligned sub-intervals for each alignment, and collect
+# them so that they can be saved into the NLMSA in one go.
+#
+
+aligned_ivals = []
+for n, (key, a, b) in enumerate(results):
     if n % 100 == 0:
         print '...', n
 
@@ -83,21 +133,21 @@ for n, key in enumerate(common_keys):
     ecoli_ival = ecoli_genome[ecoli_start:ecoli_stop]
     salm_ival = salm_genome[salm_start:salm_stop]
 
-    # run clustalw
-    a, b = run_pair_clustalw(ecoli_ival, salm_ival)
-
     # build list of aligned sub-intervals
-    interval_list = build_interval_list(a, b)
+    interval_list = build_interval_array(a, b, as_array=True)
 
-    # save!
-    for (a, b, x, y) in interval_list:
-        ec = ecoli_ival[a:b]
-        sa = salm_ival[x:y]
+    # convert to absolute coordinates
+    aligned_ivals.extend(nlmsa_bulk.make_aligned_intervals(ecoli_ival,
+                                                           salm_ival,
+                                                           interval_list))
 
-        alignment[ec] += sa
+if pool is not None:
+    pool.close()
+    pool.join()
 
-    if n > 500:
-       break
+# save!
+attrs = nlmsa_bulk.ALIGNED_IVALS_ATTRS
+alignment.add_aligned_intervals(aligned_ivals, alignedIvalsAttrs=attrs)
 
 # "build" NLMSA object (this saves it to disk, too)
 alignment.build(saveSeqDict=True)
@@ -1,39 +1,242 @@
+import itertools
+import os
+import shutil
 import subprocess
+import tempfile
+import zlib
+from hashlib import sha1
+
+import numpy
+
+def iter_alignment(fp):
+    """
+    Read aligned sequences from a CLUSTAL (.aln) or aligned FASTA file,
+    yielding (name, gapped sequence) tuples in file order.
+
+    The file is read a line at a time and never held in memory as a
+    whole.  Aligned FASTA records are yielded as soon as they're
+    complete; CLUSTAL files interleave the sequences in blocks, so those
+    come out once the last block has been read.
+    """
+    lines = iter(fp)
+    try:
+        first = lines.next()
+    except StopIteration:
+        return
+
+    if first.startswith('CLUSTAL'):
+        rows = _iter_clustal_rows(lines)
+    elif first.startswith('>'):
+        rows = _iter_fasta_rows(itertools.chain([first], lines))
+    else:
+        raise ValueError("unknown alignment format: %r" % (first,))
+
+    for row in rows:
+        yield row
+
+def _iter_clustal_rows(lines):
+    # collect the chunks for each sequence in a list & join them at the
+    # end, rather than building up strings with +=.
+    names = []
+    chunks = {}
+    for line in lines:
+        # skip blank lines and the conservation lines under each block.
+        if not line.strip() or line[0] in ' \t':
+            continue
+
+        fields = line.split()
+        name, seq = fields[0], fields[1]
+
+        l = chunks.get(name)
+        if l is None:
+            names.append(name)
+            l = chunks[name] = []
+        l.append(seq)
+
+    for name in names:
+        yield name, ''.join(chunks[name])
+
+def _iter_fasta_rows(lines):
+    name = None
+    chunks = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('>'):
+            if name is not None:
+                yield name, ''.join(chunks)
+            name = line[1:].strip()
+            chunks = []
+        elif line:
+            chunks.append(line)
+
+    if name is not None:
+        yield name, ''.join(chunks)
 
 def read_pair_clustalw(fp):
     """
     Read aligned sequences from a pairwise CLUSTALW alignment.
     """
-    lines = fp.readlines()
-    assert lines[0].startswith('CLUSTAL '), lines[0]
-
-    lines = lines[3:]
-    a = ''
-    b = ''
-    for i in range(0, len(lines), 4):
-        x, y, = lines[i:i+2]
-        a += x[16:].strip()
-        b += y[16:].strip()
+    rows = [ seq for (name, seq) in iter_alignment(fp) ]
+    assert len(rows) == 2, len(rows)
 
+    a, b = rows
     return a, b
 
-def run_pair_clustalw(top, bot):
+def run_pair_clustalw(top, bot, clustalw='clustalw'):
     """
     Run a pairwise CLUSTALW alignment on the two sequences & returned
     aligned sequences.
+
+    Each call works in its own scratch directory, which is removed
+    afterwards, so it's safe to run many of these at once from threads
+    or processes.
     """
-    fp = open('out', 'w')
-    print >>fp, '>ecoli'
-    print >>fp, top
-    print >>fp, '>salm'
-    print >>fp, bot
-    fp.close()
+    scratch = tempfile.mkdtemp(prefix='clustalw-')
+    try:
+        infile = os.path.join(scratch, 'out')
+        fp = open(infile, 'w')
+        print >>fp, '>ecoli'
+        print >>fp, top
+        print >>fp, '>salm'
+        print >>fp, bot
+        fp.close()
+
+        devnull = open(os.devnull, 'w')
+        try:
+            subprocess.check_call([clustalw, '-infile=' + infile],
+                                  cwd=scratch, stdout=devnull)
+        finally:
+            devnull.close()
 
-    subprocess.check_call('clustalw out', shell=True, stdout=subprocess.PIPE)
+        fp = open(os.path.join(scratch, 'out.aln'))
+        try:
+            a, b = read_pair_clustalw(fp)
+        finally:
+            fp.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
 
-    a, b = read_pair_clustalw(open('out.aln'))
     return a, b
 
+class ClustalwCache:
+    """
+    A persistent on-disk cache of pairwise CLUSTALW alignments.
+
+    Alignments are stored in 'cache_dir', one zlib-compressed file per
+    alignment, named by a SHA-1 hash of the two input sequences and the
+    aligner used.  Once the cache grows past 'max_size' bytes the least
+    recently used alignments are thrown away.
+
+    Use `cache.run_pair_clustalw(top, bot)` in place of
+    `run_pair_clustalw(top, bot)`.
+    """
+    def __init__(self, cache_dir, max_size=512*1024*1024,
+                 clustalw='clustalw'):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.clustalw = clustalw
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.size = sum([ size for (_, size, _) in self._list_entries() ])
+
+    def _list_entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.aln.z'):
+                continue
+
+            filename = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(filename)
+            except OSError:                 # evicted by someone else
+                continue
+            entries.append((st.st_mtime, st.st_size, filename))
+
+        return entries
+
+    def _make_key(self, top, bot):
+        h = sha1()
+        h.update(self.clustalw)
+        h.update('\0')
+        h.update(str(top))
+        h.update('\0')
+        h.update(str(bot))
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, key + '.aln.z')
+
+    def get(self, top, bot):
+        """
+        Return the cached (a, b) alignment of top and bot, or None.
+        """
+        filename = self._filename(self._make_key(top, bot))
+        try:
+            data = open(filename, 'rb').read()
+        except IOError:
+            return None
+
+        try:
+            os.utime(filename, None)        # mark as recently used
+        except OSError:
+            pass
+
+        a, b = zlib.decompress(data).split('\n')
+        return a, b
+
+    def put(self, top, bot, a, b):
+        """
+        Save the (a, b) alignment of top and bot.
+        """
+        filename = self._filename(self._make_key(top, bot))
+        data = zlib.compress(a + '\n' + b)
+
+        # write to a temporary file & rename, so that concurrent readers
+        # never see a partial entry.
+        fd, tmpname = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        os.rename(tmpname, filename)
+
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used alignments until the cache fits in
+        max_size.
+        """
+        entries = self._list_entries()
+        entries.sort()
+
+        self.size = sum([ size for (_, size, _) in entries ])
+        for (_, size, filename) in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
+            self.size -= size
+
+    def run_pair_clustalw(self, top, bot):
+        """
+        Look up the alignment of top and bot, running CLUSTALW (and
+        caching the result) if it's not there.
+        """
+        result = self.get(top, bot)
+        if result is None:
+            a, b = run_pair_clustalw(top, bot, self.clustalw)
+            self.put(top, bot, a, b)
+            result = a, b
+
+        return result
+
 def build_interval_list(a, b):
     """
     Hacky code to extract all ungapped aligned subintervals from a
@@ -69,3 +272,64 @@ def build_interval_list(a, b):
         
     return interval_list
 
+def build_interval_array(a, b, as_array=False):
+    """
+    A vectorized version of `build_interval_list`, for long alignments.
+
+    Works on gap masks of the two aligned sequences: cumulative sums of
+    the non-gap characters give the ungapped coordinates at each column,
+    and the edges of the runs of gap-free columns give the intervals.
+
+    Returns the same list of (a_start, a_stop, b_start, b_stop) tuples
+    as `build_interval_list`, or an (N x 4) numpy int array if as_array
+    is True.
+    """
+    assert len(a) == len(b)
+
+    a_gap = numpy.frombuffer(a, dtype=numpy.uint8) == ord('-')
+    b_gap = numpy.frombuffer(b, dtype=numpy.uint8) == ord('-')
+
+    # position in each ungapped sequence at the start of each column,
+    # plus the total length at the end.
+    a_pos = numpy.zeros(len(a) + 1, dtype=numpy.int64)
+    numpy.cumsum(~a_gap, out=a_pos[1:])
+    b_pos = numpy.zeros(len(b) + 1, dtype=numpy.int64)
+    numpy.cumsum(~b_gap, out=b_pos[1:])
+
+    # find the first & one-past-last column of each gap-free run.
+    ungapped = numpy.zeros(len(a) + 2, dtype=numpy.int8)
+    ungapped[1:-1] = ~(a_gap | b_gap)
+    edges = numpy.diff(ungapped)
+    starts = numpy.flatnonzero(edges == 1)
+    stops = numpy.flatnonzero(edges == -1)
+
+    intervals = numpy.column_stack((a_pos[starts], a_pos[stops],
+                                    b_pos[starts], b_pos[stops]))
+
+    if as_array:
+        return intervals
+    return [ tuple(row) for row in intervals.tolist() ]
+
+def test():
+    import random
+
+    def random_gapped(n):
+        return ''.join([ random.choice('ACGT--') for i in range(n) ])
+
+    tests = [('', ''), ('A', 'A'), ('-', 'A'), ('A-', '-A'),
+             ('ACGT', 'ACGT'), ('AC-T', 'ACGT'), ('--AC', 'AC--')]
+    for i in range(200):
+        n = random.randint(1, 500)
+        tests.append((random_gapped(n), random_gapped(n)))
+
+    for (a, b) in tests:
+        assert build_interval_array(a, b) == build_interval_list(a, b), (a, b)
+
+    a, b = tests[-1]
+    arr = build_interval_array(a, b, as_array=True)
+    assert [ tuple(row) for row in arr.tolist() ] == build_interval_list(a, b)
+
+    print 'build_interval_array matches build_interval_list'
+
+if __name__ == '__main__':
+    test()
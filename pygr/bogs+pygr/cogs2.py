@@ -5,6 +5,8 @@ of coordinates of genes (colloquially called "COGS files" by us).
 See GenomeWrangler for usage details.
 """
 
+import numpy
+
 import spanning
 
 #
@@ -13,18 +15,21 @@ import spanning
 
 class NamedSpan(spanning.Span):
     """
-    A subclass of spanning.Span that carries with it a list of names.
+    A subclass of spanning.Span that carries with it a tuple of names.
+
+    Names are kept as tuples so that spans built from the same names
+    can share them rather than each holding a copy.
     """
+    __slots__ = ('name',)
+
     def __init__(self, start, end, name):
         spanning.Span.__init__(self, start, end)
-        self.name = list(name)
+        self.name = tuple(name)
 
     def join(self, other, within=0):
         new_span = spanning.Span.join(self, other, within)
-        new_name = []
-        new_name.extend(self.name)
-        new_name.extend(other.name)
-        return NamedSpan(new_span.start, new_span.end, new_name)
+        return NamedSpan(new_span.start, new_span.end,
+                         self.name + other.name)
 
     def __hash__(self):
         """
@@ -36,81 +41,473 @@ class NamedSpan(spanning.Span):
 # CogsLine
 #
 
-class CogsLine:
+class CogsLine(object):
+    """
+    One gene entry from a PTT file.
+
+    Fields that repeat a lot between genes (strand, COG codes, product
+    descriptions, '-' for unnamed genes) are interned, so that all of the
+    records share one copy of each.
+    """
+    __slots__ = ('start', 'end', 'strand', 'gene', 'syn', 'code', 'cog',
+                 'prod')
+
     def __init__(self, start, end, strand, gene, syn, code, cog, prod):
         self.start = start
         self.end = end
-        self.strand = strand.strip()
-        self.gene = gene.strip()
+        self.strand = intern(strand.strip())
+        self.gene = intern(gene.strip())
         self.syn = syn.strip()
-        self.code = code.strip()
-        self.cog = cog.strip()
-        self.prod = prod.strip()
+        self.code = intern(code.strip())
+        self.cog = intern(cog.strip())
+        self.prod = intern(prod.strip())
+
+#
+# iter_cogs_lines
+#
+
+def iter_cogs_lines(fp):
+    """
+    Parse a PTT file, yielding a CogsLine for each gene.  Reads the file
+    one line at a time.
+    """
+    #
+    # find the header
+    #
+    for i, line in enumerate(fp):
+        assert i < 15                   # heuristic: usually < 15
+        if line.find('Location') >= 0:
+            break
+    else:
+        assert 0, "no header found"
+
+    #
+    # ok, now run through the file & get all of the gene entries.
+    #
+    for line in fp:
+        try:
+            (loc, strand, length, pid, gene, syn, code, cog, prod) = \
+                  line.split('\t', 9)
+        except ValueError:
+            print line
+            print ":::".join(line.split('\t', 9))
+            raise
+
+        # convert coords into ints
+        (start, junk, end) = loc.split('.')
+        (start, end) = (int(start), int(end))
+
+        yield CogsLine(start, end, strand, gene, syn, code, cog, prod)
 
 #
 # CogsFileContent
 #
 
 class CogsFileContent:
+    """
+    The contents of a PTT file.
+    """
     def __init__(self, filename, chr_len):
         self.filename = filename
         self.chr_len = chr_len
+        self._index = None
+        self._sorted_cogs_lines = None
 
         self._load_cogs(filename)
 
     def _load_cogs(self, filename):
-        #
-        # read in the file & find the header
-        #
-        lines = open(filename).readlines()
-        i = 0
-        while i < 15:                       # heuristic: usually < 15
-            if lines[i].find('Location') >= 0:
-                break
+        fp = open(filename)
+        try:
+            l = list(iter_cogs_lines(fp))
+        finally:
+            fp.close()
 
-            i += 1
+        cogs_by_syn = {}
+        for cogs_line in l:
+            assert cogs_by_syn.get(cogs_line.syn) is None
+            cogs_by_syn[cogs_line.syn] = cogs_line
 
-        assert i < 15
-        line_n = i + 1
+        self._cogs_lines = l
+        self._cogs_by_syn = cogs_by_syn
 
-        #
-        # ok, now run through the file & get all of the gene entries.
-        #
+    def get_cogs_lines(self):
+        return self._cogs_lines
 
-        l = []
-        cogs_by_syn = {}
-        while line_n < len(lines):
-            # parse each line
+    def get_sorted_cogs_lines(self):
+        """
+        Return the genes sorted by start, then end; sorted once, the first
+        time it's asked for.
+        """
+        if self._sorted_cogs_lines is None:
+            l = list(self._cogs_lines)
+            l.sort(key=lambda a: (a.start, a.end))
+            self._sorted_cogs_lines = l
+        return self._sorted_cogs_lines
+
+    def get_syn(self, syn):
+        return self._cogs_by_syn.get(syn)
+
+    def get_index(self):
+        """
+        Return a CogsIndex for positional queries on the genes; it's
+        built the first time it's asked for.
+        """
+        if self._index is None:
+            self._index = CogsIndex(self._cogs_lines)
+        return self._index
 
-            try:
-                (loc, strand, length, pid, gene, syn, code, cog, prod) = \
-                      lines[line_n].split('\t', 9)
-            except ValueError:
-                print lines[line_n]
-                print ":::".join(lines[line_n].split('\t', 9))
-                raise
+#
+# CogsIndex
+#
 
-            # convert coords into ints
-            (start, junk, end) = loc.split('.')
-            (start, end) = (int(start), int(end))
+class CogsIndex:
+    """
+    A positional index over a list of CogsLines, for asking which genes
+    are at or near a position.
+
+    Positions use the same coordinates as the PTT file, i.e. a gene
+    covers start..end inclusive.  Genes are kept sorted by start, along
+    with the running maximum of their ends, so that overlap and nearest
+    gene queries are binary searches.  The '_many' methods take arrays
+    of positions and return arrays of indices into the original list
+    (-1 for "no such gene").
+    """
+    def __init__(self, cogs_lines):
+        self.cogs_lines = cogs_lines
+
+        starts = numpy.array([ a.start for a in cogs_lines ],
+                             dtype=numpy.int64)
+        ends = numpy.array([ a.end for a in cogs_lines ], dtype=numpy.int64)
+
+        order = numpy.argsort(starts, kind='mergesort')
+        self.order = order
+        self.starts = starts[order]
+        self.ends = ends[order]
+
+        # running max of the ends, and the (sorted) index of the gene that
+        # reaches it.
+        self.max_ends = numpy.maximum.accumulate(self.ends)
+        at_max = numpy.where(self.ends == self.max_ends,
+                             numpy.arange(len(order)), 0)
+        self.max_end_index = numpy.maximum.accumulate(at_max)
+
+        # per-strand starts & ends, each sorted, for upstream/downstream.
+        self.by_strand = {}
+        strands = numpy.array([ a.strand for a in cogs_lines ], dtype=str)
+        for strand in ('+', '-'):
+            idx = numpy.flatnonzero(strands == strand)
+            by_start = idx[numpy.argsort(starts[idx], kind='mergesort')]
+            by_end = idx[numpy.argsort(ends[idx], kind='mergesort')]
+            self.by_strand[strand] = (starts[by_start], by_start,
+                                      ends[by_end], by_end)
+
+    def _lines(self, indices):
+        return [ self.cogs_lines[i] for i in indices ]
+
+    def overlapping(self, start, end=None):
+        """
+        Return all genes overlapping the position 'start', or the
+        interval start..end if end is given, sorted by start.
+        """
+        if end is None:
+            end = start
 
-            # store
-            cogs_line = CogsLine(start, end, strand, gene,syn, code, cog, prod)
-            l.append(cogs_line)
+        i = numpy.searchsorted(self.starts, end, 'right') - 1
 
-            assert cogs_by_syn.get(syn) is None
-            cogs_by_syn[syn] = cogs_line
+        # walk back over genes starting at or before 'end'; once the
+        # running max end falls short of 'start', nothing further back
+        # can overlap.
+        found = []
+        while i >= 0 and self.max_ends[i] >= start:
+            if self.ends[i] >= start:
+                found.append(self.order[i])
+            i -= 1
 
-            line_n += 1
+        found.reverse()
+        return self._lines(found)
 
-        self._cogs_lines = l
-        self._cogs_by_syn = cogs_by_syn
+    def overlapping_many(self, positions):
+        """
+        Return a list of overlapping genes for each position.
+        """
+        return [ self.overlapping(pos) for pos in positions ]
 
-    def get_cogs_lines(self):
-        return self._cogs_lines
+    def nearest_many(self, positions):
+        """
+        Find the closest gene to each position.  Returns an array of
+        indices and an array of distances (0 for overlapping genes).
+        """
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        n = len(self.starts)
+        if not n:
+            nothing = numpy.zeros(len(positions), dtype=numpy.int64) - 1
+            return nothing, nothing.copy()
+
+        # the closest gene to the right starts after the position...
+        right = numpy.searchsorted(self.starts, positions, 'right')
+        has_right = right < n
+        right_dist = numpy.where(has_right,
+                                 self.starts[numpy.minimum(right, n - 1)] -
+                                 positions, numpy.iinfo(numpy.int64).max)
+
+        # ...and the closest gene to the left (or overlapping) is the one
+        # reaching furthest among the genes that start before it.
+        left = right - 1
+        has_left = left >= 0
+        left_c = numpy.maximum(left, 0)
+        left_dist = numpy.where(has_left,
+                                numpy.maximum(positions -
+                                              self.max_ends[left_c], 0),
+                                numpy.iinfo(numpy.int64).max)
+
+        use_left = has_left & (left_dist <= right_dist)
+        sorted_i = numpy.where(use_left, self.max_end_index[left_c],
+                               numpy.minimum(right, n - 1))
+        indices = self.order[sorted_i]
+        distances = numpy.where(use_left, left_dist, right_dist)
+
+        return indices, distances
+
+    def nearest(self, pos):
+        """
+        Return the gene closest to pos, or None.
+        """
+        indices, _ = self.nearest_many([pos])
+        if indices[0] < 0:
+            return None
+        return self.cogs_lines[indices[0]]
 
-    def get_syn(self, syn):
-        return self._cogs_by_syn.get(syn)
+    def downstream_many(self, positions, strand):
+        """
+        For each position, find the nearest gene on the given strand
+        that lies entirely downstream of it, in that strand's direction.
+        """
+        return self._find_many(positions, strand, strand == '+')
+
+    def upstream_many(self, positions, strand):
+        """
+        For each position, find the nearest gene on the given strand
+        that lies entirely upstream of it, in that strand's direction.
+        """
+        return self._find_many(positions, strand, strand == '-')
+
+    def _find_many(self, positions, strand, to_right):
+        positions = numpy.asarray(positions, dtype=numpy.int64)
+        starts, by_start, ends, by_end = self.by_strand[strand]
+        if not len(starts):
+            return numpy.zeros(len(positions), dtype=numpy.int64) - 1
+
+        if to_right:                    # first gene starting after pos
+            i = numpy.searchsorted(starts, positions, 'right')
+            found = by_start[numpy.minimum(i, len(starts) - 1)]
+            return numpy.where(i < len(starts), found, -1)
+        else:                           # last gene ending before pos
+            i = numpy.searchsorted(ends, positions, 'left') - 1
+            found = by_end[numpy.maximum(i, 0)]
+            return numpy.where(i >= 0, found, -1)
+
+    def downstream(self, pos, strand):
+        """
+        Return the nearest gene downstream of pos on the given strand.
+        """
+        i = self.downstream_many([pos], strand)[0]
+        if i < 0:
+            return None
+        return self.cogs_lines[i]
+
+    def upstream(self, pos, strand):
+        """
+        Return the nearest gene upstream of pos on the given strand.
+        """
+        i = self.upstream_many([pos], strand)[0]
+        if i < 0:
+            return None
+        return self.cogs_lines[i]
+
+##############
+
+#
+# GenomeRegions
+#
+
+FOOTPRINT = 'footprint'
+INTERGENIC = 'intergenic'
+OPERON = 'operon'
+PROMOTER = 'promoter'
+
+def _make_operon_name(a):
+    if a.gene != '-':
+        return "%s (%s)" % (a.gene, a.syn,)
+    else:
+        return a.syn
+
+class GenomeRegions:
+    """
+    Derive coding footprints, intergenic regions, putative operons and
+    putative promoters for a genome in a single sweep over its genes,
+    sorted by position.
+
+    `sweep()` generates (kind, start, end, name, strand) tuples for all
+    four kinds of region at once; 'kind' is one of FOOTPRINT, INTERGENIC,
+    OPERON or PROMOTER, and 'strand' is only set for operons and
+    promoters.  `coding_footprints()`, `intergenic()`, `operons()` and
+    `promoters()` generate a single kind of region.  Nothing is
+    materialized: each call runs a fresh sweep.
+
+    The regions are the same as those of CodingRegionsByFootprint,
+    IntergenicRegionsByFootprint, PutativeOperons and PutativePromoters,
+    with the same 'overlap', 'operon_overlap', 'coding_overlap' and
+    'nc_overlap' parameters.
+    """
+    def __init__(self, cogs_file_content, overlap=0, operon_overlap=1,
+                 coding_overlap=1, nc_overlap=0):
+        assert isinstance(cogs_file_content, CogsFileContent)
+        self.cogs_content = cogs_file_content
+        self.overlap = overlap
+        self.operon_overlap = operon_overlap
+        self.coding_overlap = coding_overlap
+        self.nc_overlap = nc_overlap
+
+    def _select(self, kind):
+        for (k, start, end, name, strand) in self.sweep():
+            if k == kind:
+                yield start, end, name
+
+    def coding_footprints(self):
+        "Generate (start, end, name) for each continuous coding region."
+        return self._select(FOOTPRINT)
+
+    def intergenic(self):
+        "Generate (start, end, name) for each intergenic region."
+        return self._select(INTERGENIC)
+
+    def promoters(self):
+        "Generate (start, end, name) for each putative promoter."
+        return self._select(PROMOTER)
+
+    def operons(self):
+        "Generate (start, end, name, strand) for each putative operon."
+        for (k, start, end, name, strand) in self.sweep():
+            if k == OPERON:
+                yield start, end, name, strand
+
+    def sweep(self):
+        cogs_lines = self.cogs_content.get_sorted_cogs_lines()
+        if not cogs_lines:
+            return
+
+        overlap = self.overlap
+        nc_overlap = self.nc_overlap
+        chr_len = self.cogs_content.chr_len
+
+        def region(kind, start, end, name, strand=None):
+            return (kind, min(start, end), max(start, end), name, strand)
+
+        footprint = None                # [start, end, name]
+        coding = None                   # ditto, but including the last base
+        prev_coding = None
+        operon = None                   # [start, end, name, strand]
+        p_operon = None                 # operons as seen by promoters
+
+        # promoter assignment state
+        last_end = 0
+        next_name = None
+        next_start = None
+
+        for a in cogs_lines + [None]:
+            if a is not None:
+                gene = (a.gene,)
+                op_name = (_make_operon_name(a),)
+
+            #
+            # coding footprints: genes joined wherever they overlap.
+            #
+            if a is not None and footprint is not None and \
+                   a.start - 1 <= footprint[1]:
+                footprint[1] = max(footprint[1], a.end - 1)
+                footprint[2] += gene
+            else:
+                if footprint is not None:
+                    yield region(FOOTPRINT, *footprint)
+                if a is not None:
+                    footprint = [a.start - 1, a.end - 1, gene]
+
+            #
+            # intergenic regions: the gaps between coding footprints
+            # (counted up to and including the last base of each gene),
+            # named by the genes on either side.
+            #
+            if a is not None and coding is not None and \
+                   a.start - 1 <= coding[1]:
+                coding[1] = max(coding[1], a.end)
+                coding[2] += gene
+            else:
+                if coding is not None:
+                    if prev_coding is None:
+                        yield region(INTERGENIC, 0, coding[0] + overlap - 1,
+                                     ("",) + coding[2])
+                    else:
+                        yield region(INTERGENIC,
+                                     prev_coding[1] - overlap + 1,
+                                     coding[0] + overlap - 1,
+                                     prev_coding[2] + coding[2])
+                    prev_coding = coding
+                if a is not None:
+                    coding = [a.start - 1, a.end, gene]
+
+            #
+            # operons: runs of overlapping/adjacent genes on one strand.
+            #
+            if a is not None and operon is not None and \
+                   a.strand == operon[3] and \
+                   a.start - 1 <= operon[1] + self.operon_overlap:
+                operon[1] = max(operon[1], a.end)
+                operon[2] += op_name
+            else:
+                if operon is not None:
+                    yield region(OPERON, *operon)
+                if a is not None:
+                    operon = [a.start - 1, a.end, op_name, a.strand]
+
+            #
+            # promoters: the intergenic region upstream of each operon.
+            #
+            if a is not None and p_operon is not None and \
+                   a.strand == p_operon[3] and \
+                   a.start - 1 <= p_operon[1] + self.coding_overlap:
+                p_operon[1] = max(p_operon[1], a.end - 1)
+                p_operon[2] += op_name
+            else:
+                if p_operon is not None:
+                    (start, end, name, direction) = p_operon
+                    next_start = start
+
+                    # the next intergenic region belongs to the last
+                    # operon...
+                    if next_name:
+                        yield region(PROMOTER, last_end - nc_overlap + 1,
+                                     next_start + nc_overlap - 1, next_name,
+                                     '-')
+                        next_name = None
+
+                    # does this intergenic region belong to this operon?
+                    if direction == '+':
+                        yield region(PROMOTER, last_end - nc_overlap + 1,
+                                     next_start + nc_overlap - 1, name, '+')
+                        next_name = None
+                    elif direction == '-':      # nope, the next.
+                        next_name = name
+
+                    last_end = end
+                if a is not None:
+                    p_operon = [a.start - 1, a.end - 1, op_name, a.strand]
+
+        yield region(INTERGENIC, prev_coding[1] - overlap + 1, chr_len,
+                     prev_coding[2] + ("",))
+
+        if next_name:
+            yield region(PROMOTER, last_end - nc_overlap + 1,
+                         next_start + nc_overlap - 1, next_name, '-')
 
 ##############
 
@@ -170,10 +567,9 @@ class CodingRegionsByFootprint(_RegionsList):
         assert isinstance(cogs_file_content, CogsFileContent)
         self.cogs_content = cogs_file_content
 
-        spans = [ NamedSpan(a.start - 1, a.end - 1, (a.gene,)) for \
-                  a in self.cogs_content.get_cogs_lines() ]
-        spans = spanning.join(spans)
-        self.spans = spans
+        regions = GenomeRegions(cogs_file_content)
+        self.spans = [ NamedSpan(start, end, name) for (start, end, name) \
+                       in regions.coding_footprints() ]
 
 ##############
 
@@ -186,44 +582,9 @@ class IntergenicRegionsByFootprint(_RegionsList):
         self.cogs_content = cogs_file_content
         self.overlap = overlap
 
-        chr_len = cogs_file_content.chr_len
-
-        # first get the coding spans & join 'em
-        coding_spans = [ NamedSpan(a.start - 1, a.end, (a.gene,)) for \
-                  a in self.cogs_content.get_cogs_lines() ]
-        coding_spans = spanning.join(coding_spans)
-
-        # then run through and construct the list of complemented spans.
-        spans = []
-        prev_span = coding_spans[0]
-
-        # for the first span, start at 0 & go to the beginning of the
-        # first gene.
-        
-        new_name = ["",]
-        new_name.extend(prev_span.name)
-        spans.append(NamedSpan(0, prev_span.start + overlap - 1, new_name))
-
-        # for each successive region, take the end of the previous gene
-        # and the start of the next & make a span out of it.  account
-        # for overlaps...
-
-        for i in range(1, len(coding_spans)):
-            span = coding_spans[i]
-            new_name = []
-            new_name.extend(prev_span.name)
-            new_name.extend(span.name)
-            
-            spans.append(NamedSpan(prev_span.end - overlap + 1,
-                                   span.start + overlap - 1,
-                                   new_name))
-            prev_span = span
-
-        new_name = []
-        new_name.extend(prev_span.name)
-        new_name.append("")
-        spans.append(NamedSpan(prev_span.end - overlap + 1, chr_len, new_name))
-        self.spans = spans
+        regions = GenomeRegions(cogs_file_content, overlap=overlap)
+        self.spans = [ NamedSpan(start, end, name) for (start, end, name) \
+                       in regions.intergenic() ]
 
 ##############
 
@@ -240,36 +601,15 @@ class PutativeOperons(_RegionsList):
         assert isinstance(cogs_file_content, CogsFileContent)
         self.cogs_content = cogs_file_content
 
-        cogs_lines = cogs_file_content.get_cogs_lines()
+        regions = GenomeRegions(cogs_file_content, operon_overlap=overlap)
 
-        def make_name(cogs_line):
-            if a.gene != '-':
-                return "%s (%s)" % (a.gene, a.syn,)
-            else:
-                return a.syn
-            
         spans = []
-
-        a = cogs_lines[0]
-        last_span = NamedSpan(a.start - 1, a.end, (make_name(a),))
-        last_orient = a.strand
-
         orients = {}
-        
-        for a in cogs_lines[1:]:
-            span = NamedSpan(a.start - 1, a.end, (make_name(a.gene),))
-            if a.strand == last_orient and last_span.overlaps(span, overlap):
-                last_span = last_span.join(span, overlap)
-            else:
-                spans.append(last_span)
-                orients[last_span] = last_orient
-                
-                last_span = span
-                last_orient = a.strand
-
-            ## either way, we've consumed last_span.
+        for (start, end, name, strand) in regions.operons():
+            span = NamedSpan(start, end, name)
+            spans.append(span)
+            orients[span] = strand
 
-        spans.append(last_span)
         self.spans = spans
         self.orients = orients
 
@@ -292,72 +632,8 @@ class PutativePromoters(_RegionsList):
         assert isinstance(cogs_file_content, CogsFileContent)
         self.cogs_content = cogs_file_content
 
-        cogs_lines = cogs_file_content.get_cogs_lines()
-
-        #
-        # first, construct a list of operons + directions.
-        #
-
-        def make_name(cogs_line):
-            if a.gene != '-':
-                return "%s (%s)" % (a.gene, a.syn,)
-            else:
-                return a.syn
-
-        operons = []
-
-        a = cogs_lines[0]
-        last_span = NamedSpan(a.start - 1, a.end - 1, (make_name(a),))
-        last_orient = a.strand
-        
-        for a in cogs_lines[1:]:
-            name = make_name(a)
-            span = NamedSpan(a.start - 1, a.end - 1, (name,))
-            if a.strand == last_orient and last_span.overlaps(span,
-                                                              coding_overlap):
-                last_span = last_span.join(span, coding_overlap)
-            else:
-                operons.append((last_span, last_orient))
-
-                last_span = span
-                last_orient = a.strand
-
-        operons.append((last_span, last_orient))
-        
-
-        #
-        # now, for each operon, assign an intergenic region (if possible)
-        #
-
-        last_end = 0
-        promoters = []
-        next_name = None
-
-        for (operon, direction) in operons:
-            next_start = operon.start
-
-            # the next intergenic region belongs to the last operon...
-            if next_name:
-                promoter = NamedSpan(last_end - nc_overlap + 1,
-                                     next_start + nc_overlap - 1, next_name)
-                promoters.append(promoter)
-                next_name = None
-
-            # does this intergenic region belong to this operon?
-            if direction == '+':
-                promoter = NamedSpan(last_end - nc_overlap + 1,
-                                     next_start + nc_overlap - 1, operon.name)
-                promoters.append(promoter)
-                next_name = None
-            elif direction == '-':      # nope, the next.
-                next_name = operon.name
-
-            last_end = operon.end
-
-        # redux
-        if next_name:
-            promoter = NamedSpan(last_end - nc_overlap + 1,
-                                 next_start + nc_overlap - 1, next_name)
-            promoters.append(promoter)
-            
-        self.spans = promoters
+        regions = GenomeRegions(cogs_file_content,
+                                coding_overlap=coding_overlap,
+                                nc_overlap=nc_overlap)
+        self.spans = [ NamedSpan(start, end, name) for (start, end, name) \
+                       in regions.promoters() ]
@@ -1,8 +1,15 @@
 #! /usr/bin/env python2.5
 import sys
 from pygr import cnestedlist
-import motility
 import bndarray
+import nlmsa_projection
+import mutation_profile
+
+# motility is optional; without it, scan with bndarray's own matcher.
+try:
+    import motility
+except ImportError:
+    motility = None
 
 #
 # first, load in the ecoli/salm alignments.
@@ -14,23 +21,37 @@ alignment = cnestedlist.NLMSA('pairbac', 'r', use_virtual_lpo=True)
 # retrieve the E. coli genome from the alignment.
 ecoli_genome = alignment.seqDict['ecoliK12']
 
-# load energy operator
-op_en = bndarray.parse_as_motility_operator(open('crp_init.open'))
-op_en = motility.EnergyOperator(op_en)
+#
+# now, load the energy operator, search for motif matches and iterate over
+# the results.
+#
+
+if motility is not None:
+    op_en = bndarray.parse_as_motility_operator(open('crp_init.open'))
+    op_en = motility.EnergyOperator(op_en)
+    motif_len = len(op_en)
+
+    find = lambda seq: op_en.find(seq, 7.0)
+    results = bndarray.find_in_windows(find, ecoli_genome, motif_len)
+else:
+    op_en = bndarray.parse_bndarray(open('crp_init.open'))
+    motif_len = op_en.length
+
+    results = op_en.find(ecoli_genome, 7.0)
 
 #
-# now, search for motif matches and iterate over the results.
+# pull out all of the aligned blocks on the E. coli genome in one query,
+# and walk the (sorted) motif matches along them.
 #
 
-results = op_en.find(str(ecoli_genome), 7.0)
+blocks = nlmsa_projection.get_aligned_blocks(alignment, ecoli_genome)
 
-count = 0
-diffs = [0] * len(op_en)
-for (start, stop, orient, _) in results:
+profile = mutation_profile.MutationProfile(motif_len)
+for (start, stop, orient, _), salm_sites in \
+        nlmsa_projection.project_hits(blocks, results):
 
     #
-    # convert each motif match into a sliced sequence suitable for
-    # querying the NLMSA.
+    # convert each motif match into a sliced sequence.
     #
 
     ecoli_site = ecoli_genome[start:stop]
@@ -38,24 +59,14 @@ for (start, stop, orient, _) in results:
         ecoli_site = -ecoli_site        # reverse complement
 
     #
-    # get an edge to the aligned salmonella sequences (if any)
+    # 'salm_sites' holds the aligned salmonella sequences (if any) that
+    # have precisely the right size (no gaps/insertions, and with length
+    # equal to the query).
     #
 
-    edge = alignment[ecoli_site]
-
-    #
-    # now *retrieve* aligned sequences that have precisely the right size
-    # (no gaps/insertions, by default, and with length equal to the query)
-    #
-
-    salm_sites = edge.keys(minAlignSize=len(ecoli_site))
-
-    for n, salm_site in enumerate(salm_sites):
-        count += 1
-        for j in range(0, len(ecoli_site)):
-            if str(ecoli_site)[j] != str(salm_site)[j]:
-                diffs[j] += 1
+    for salm_site in salm_sites:
+        profile.add(ecoli_site, salm_site)
 
 # print mutation profile
-for n, val in enumerate(diffs):
-    print n, val / float(count)
+for n, val in enumerate(profile.get_mismatch_fractions()):
+    print n, val
@@ -0,0 +1,242 @@
+#! /usr/bin/env python2.6
+"""
+Extract intergenic regions from many genomes at once & find the ones
+they have in common.
+
+The input is a manifest file with one genome per line:
+
+   fasta_id <tab> ptt_file [<tab> chromosome_length]
+
+where 'fasta_id' is the name of the chromosome in the FASTA/BlastDB file
+and 'ptt_file' is its NCBI PTT annotation file.  If the chromosome length
+is left out, it's taken from the PTT header line.
+
+The intergenic regions of each genome are computed in parallel and
+cached (see `IntergenicCache`), so that re-running with one new genome
+only costs the work for that genome.  Intergenic regions are matched up
+between genomes by the names of their flanking genes, as in
+build-clustalw-aligns.py.
+
+Usage:
+
+   intergenic_batch.py [-j N] [-c cache_dir] [-r ref_id] manifest
+"""
+import os
+import itertools
+import cPickle
+from hashlib import sha1
+from optparse import OptionParser
+from multiprocessing import Pool
+
+import cogs2
+
+### a utility function to get only "interesting" (named, with length)
+### intergenic regions from the PTT file.
+
+def get_intergenic_intervals(ptt_info, overlap=0):
+    regions = cogs2.GenomeRegions(ptt_info, overlap=overlap)
+
+    interval_dict = {}
+    for (start, end, name) in regions.intergenic():
+        if '-' in name:
+            continue
+
+        key = tuple(name)
+        if end - start > 0:
+            interval_dict[key] = (start, end) # @CTB check end!
+
+    return interval_dict
+
+#
+# manifest parsing
+#
+
+def read_ptt_chr_len(ptt_file):
+    """
+    Get the chromosome length from the first line of a PTT file, e.g.
+    'Escherichia coli K12, complete genome - 1..4639675'.
+    """
+    line = open(ptt_file).readline()
+    return int(line.rsplit('..', 1)[1])
+
+def read_manifest(fp):
+    """
+    Read a manifest file; returns a list of (fasta_id, ptt_file, chr_len).
+    PTT file names are taken relative to the manifest's directory.
+    """
+    basedir = os.path.dirname(os.path.abspath(getattr(fp, 'name', '.')))
+
+    genomes = []
+    for line in fp:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split('\t')
+        fasta_id, ptt_file = fields[0], os.path.join(basedir, fields[1])
+        if len(fields) > 2:
+            chr_len = int(fields[2])
+        else:
+            chr_len = read_ptt_chr_len(ptt_file)
+
+        genomes.append((fasta_id, ptt_file, chr_len))
+
+    return genomes
+
+#
+# IntergenicCache
+#
+
+class IntergenicCache:
+    """
+    An on-disk cache of intergenic interval dictionaries, one pickle per
+    genome, keyed by the PTT file's path, size & mtime, the chromosome
+    length, and the overlap parameter.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def _filename(self, ptt_file, chr_len, overlap):
+        st = os.stat(ptt_file)
+        h = sha1(repr((os.path.abspath(ptt_file), st.st_size, st.st_mtime,
+                       chr_len, overlap)))
+        return os.path.join(self.cache_dir, h.hexdigest() + '.intergenic')
+
+    def get(self, ptt_file, chr_len, overlap=0):
+        try:
+            fp = open(self._filename(ptt_file, chr_len, overlap), 'rb')
+        except IOError:
+            return None
+
+        try:
+            return cPickle.load(fp)
+        finally:
+            fp.close()
+
+    def put(self, ptt_file, chr_len, overlap, interval_dict):
+        filename = self._filename(ptt_file, chr_len, overlap)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+
+        fp = open(tmp_filename, 'wb')
+        try:
+            cPickle.dump(interval_dict, fp, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            fp.close()
+        os.rename(tmp_filename, filename)
+
+#
+# the batch pipeline
+#
+
+def _load_intergenic(args):
+    (fasta_id, ptt_file, chr_len, overlap, cache_dir) = args
+
+    cache = None
+    if cache_dir:
+        cache = IntergenicCache(cache_dir)
+        interval_dict = cache.get(ptt_file, chr_len, overlap)
+        if interval_dict is not None:
+            return fasta_id, interval_dict
+
+    ptt_info = cogs2.CogsFileContent(ptt_file, chr_len)
+    interval_dict = get_intergenic_intervals(ptt_info, overlap)
+
+    if cache is not None:
+        cache.put(ptt_file, chr_len, overlap, interval_dict)
+
+    return fasta_id, interval_dict
+
+def load_all_intergenic(genomes, processes=1, cache_dir=None, overlap=0):
+    """
+    Compute the intergenic interval dictionaries for each of the
+    (fasta_id, ptt_file, chr_len) genomes, using a pool of 'processes'
+    workers.  Returns a dictionary mapping fasta_id to interval dict.
+    """
+    jobs = [ (fasta_id, ptt_file, chr_len, overlap, cache_dir) for \
+             (fasta_id, ptt_file, chr_len) in genomes ]
+
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            results = pool.map(_load_intergenic, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = map(_load_intergenic, jobs)
+
+    return dict(results)
+
+def build_key_index(intergenic):
+    """
+    Given a dictionary of fasta_id -> intergenic interval dict, build a
+    dictionary mapping each intergenic key to a dictionary of
+    fasta_id -> (start, end) for every genome that has it.
+    """
+    index = {}
+    for fasta_id, interval_dict in intergenic.iteritems():
+        for key, ival in interval_dict.iteritems():
+            d = index.get(key)
+            if d is None:
+                d = index[key] = {}
+            d[fasta_id] = ival
+
+    return index
+
+def find_shared_keys(index, reference=None):
+    """
+    Find the intergenic keys shared by each pair of genomes, in one pass
+    over the key index.  If 'reference' is given, only pairs including
+    the reference genome are considered.
+
+    Returns a dictionary mapping (fasta_id_1, fasta_id_2) to a sorted
+    list of shared keys.
+    """
+    shared = {}
+    for key, d in index.iteritems():
+        if len(d) < 2:
+            continue
+
+        if reference is not None:
+            if reference not in d:
+                continue
+            pairs = [ (reference, other) for other in sorted(d) \
+                      if other != reference ]
+        else:
+            pairs = itertools.combinations(sorted(d), 2)
+
+        for pair in pairs:
+            l = shared.get(pair)
+            if l is None:
+                l = shared[pair] = []
+            l.append(key)
+
+    for l in shared.itervalues():
+        l.sort()
+
+    return shared
+
+if __name__ == '__main__':
+    parser = OptionParser(usage='%prog [options] manifest')
+    parser.add_option('-j', '--processes', dest='processes', type='int',
+                      default=1, help='number of worker processes')
+    parser.add_option('-c', '--cache', dest='cache_dir', default=None,
+                      help='cache intergenic regions in CACHE_DIR')
+    parser.add_option('-r', '--reference', dest='reference', default=None,
+                      help='only pair genomes against REFERENCE')
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error('need a manifest file')
+
+    genomes = read_manifest(open(args[0]))
+    intergenic = load_all_intergenic(genomes, options.processes,
+                                     options.cache_dir)
+
+    index = build_key_index(intergenic)
+    shared = find_shared_keys(index, options.reference)
+
+    for (a, b) in sorted(shared):
+        print '%s\t%s\t%d' % (a, b, len(shared[(a, b)]))
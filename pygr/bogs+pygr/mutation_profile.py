@@ -0,0 +1,109 @@
+"""
+Position-specific mutation profiles of aligned binding sites.
+
+A `MutationProfile` collects pairs of aligned, equal-length sites (say, an
+E. coli binding site and its aligned Salmonella sequence), buffers them
+as rows of a byte matrix, and reduces them all at once into a full 5x5
+substitution count matrix (A, C, G, T, N) for every position.  Mismatch
+counts and conservation per position are computed from that.
+
+Profiles can be updated incrementally with `add` and `add_many`, and
+partial profiles from parallel workers combined with `merge`.
+"""
+import numpy
+
+import bndarray
+
+N_SYMBOLS = 5                           # A, C, G, T, N
+
+class MutationProfile:
+    """
+    Accumulate substitution counts for aligned site pairs of width
+    'width'.
+    """
+    def __init__(self, width, buffer_size=10000):
+        self.width = int(width)
+        self.buffer_size = buffer_size
+
+        self.counts = numpy.zeros((self.width, N_SYMBOLS, N_SYMBOLS),
+                                  dtype=numpy.int64)
+        self._pending_a = []
+        self._pending_b = []
+
+    def add(self, site_a, site_b):
+        """
+        Add one pair of aligned sites (strings or pygr sequences).
+        """
+        site_a, site_b = str(site_a), str(site_b)
+        assert len(site_a) == self.width and len(site_b) == self.width
+
+        self._pending_a.append(site_a)
+        self._pending_b.append(site_b)
+        if len(self._pending_a) >= self.buffer_size:
+            self._flush()
+
+    def add_many(self, pairs):
+        """
+        Add many (site_a, site_b) pairs.
+        """
+        for (site_a, site_b) in pairs:
+            self.add(site_a, site_b)
+
+    def add_codes(self, codes_a, codes_b):
+        """
+        Add two (N x width) code arrays, as built by bndarray.encode_sites.
+        """
+        codes_a = numpy.asarray(codes_a, dtype=numpy.int64)
+        codes_b = numpy.asarray(codes_b, dtype=numpy.int64)
+        assert codes_a.shape == codes_b.shape
+        assert codes_a.shape[1:] == (self.width,)
+
+        # a single bincount over (position, base a, base b) indices.
+        positions = numpy.arange(self.width)
+        flat = (positions * N_SYMBOLS + codes_a) * N_SYMBOLS + codes_b
+        counts = numpy.bincount(flat.ravel(),
+                                minlength=self.width * N_SYMBOLS * N_SYMBOLS)
+        self.counts += counts.reshape(self.counts.shape)
+
+    def _flush(self):
+        if self._pending_a:
+            self.add_codes(bndarray.encode_sites(self._pending_a),
+                           bndarray.encode_sites(self._pending_b))
+            self._pending_a = []
+            self._pending_b = []
+
+    def merge(self, other):
+        """
+        Add the counts from another MutationProfile of the same width.
+        """
+        assert other.width == self.width
+        other._flush()
+        self._flush()
+        self.counts += other.counts
+
+    def get_substitutions(self):
+        """
+        Return the (width x 5 x 5) array of substitution counts;
+        [i, a, b] counts base a in the first site aligned to base b in
+        the second at position i.  Bases are numbered A, C, G, T, N.
+        """
+        self._flush()
+        return self.counts
+
+    def get_count(self):
+        "Number of site pairs added so far."
+        return int(self.get_substitutions()[0].sum())
+
+    def get_mismatches(self):
+        "Number of mismatches at each position."
+        counts = self.get_substitutions()
+        matches = numpy.trace(counts, axis1=1, axis2=2)
+        return counts.sum(axis=2).sum(axis=1) - matches
+
+    def get_mismatch_fractions(self):
+        "Fraction of site pairs mismatched at each position."
+        return self.get_mismatches() / float(self.get_count())
+
+    def get_conservation(self):
+        "Fraction of site pairs identical at each position."
+        return 1. - self.get_mismatch_fractions()
@@ -0,0 +1,79 @@
+"""
+Bulk loading of pairwise alignments into a pygr NLMSA.
+
+Adding each ungapped block with `alignment[ec] += sa` builds two sequence
+slices and goes through the NLMSA slice machinery once per block.  The
+functions here instead hand the NLMSA the raw coordinates of all of the
+blocks at once, via `NLMSA.add_aligned_intervals`.
+
+Run this file directly to benchmark the two approaches.
+"""
+import time
+
+import numpy
+
+# the layout of the tuples built by make_aligned_intervals.
+ALIGNED_IVALS_ATTRS = dict(id=0, start=1, stop=2,
+                           idDest=3, startDest=4, stopDest=5)
+
+def make_aligned_intervals(src, dest, intervals):
+    """
+    Convert (a, b, x, y) coordinates relative to the sequence slices
+    'src' and 'dest' -- the output of `clustalw_utils.build_interval_list`
+    or `build_interval_array` -- into a list of absolute
+    (src_id, start, stop, dest_id, dest_start, dest_stop) tuples.
+    """
+    intervals = numpy.asarray(intervals, dtype=numpy.int64).reshape(-1, 4)
+
+    coords = numpy.empty_like(intervals)
+    coords[:, 0:2] = intervals[:, 0:2] + src.start
+    coords[:, 2:4] = intervals[:, 2:4] + dest.start
+
+    src_id = src.path.id
+    dest_id = dest.path.id
+    return [ (src_id, a, b, dest_id, x, y) for (a, b, x, y) in coords.tolist() ]
+
+def add_intervals(alignment, src, dest, intervals):
+    """
+    Add all of the aligned blocks between 'src' and 'dest' to the NLMSA
+    'alignment' in one call.
+    """
+    aligned_ivals = make_aligned_intervals(src, dest, intervals)
+    alignment.add_aligned_intervals(aligned_ivals,
+                                    alignedIvalsAttrs=ALIGNED_IVALS_ATTRS)
+
+def add_intervals_by_slice(alignment, src, dest, intervals):
+    """
+    Add the aligned blocks one at a time, a la `alignment[ec] += sa`.
+    """
+    for (a, b, x, y) in intervals:
+        alignment[src[a:b]] += dest[x:y]
+
+def benchmark(n_blocks=100000, block_size=20):
+    from pygr import sequence, cnestedlist
+
+    seqlen = n_blocks * block_size * 2
+    seq_dict = {}
+    seq_dict['src'] = src = sequence.Sequence('A' * seqlen, 'src')
+    seq_dict['dest'] = dest = sequence.Sequence('A' * seqlen, 'dest')
+
+    starts = numpy.arange(n_blocks, dtype=numpy.int64) * block_size * 2
+    intervals = numpy.column_stack((starts, starts + block_size,
+                                    starts + 1, starts + 1 + block_size))
+
+    for name, fn in (('per-slice', add_intervals_by_slice),
+                     ('bulk', add_intervals)):
+        alignment = cnestedlist.NLMSA(name, mode='memory', seqDict=seq_dict,
+                                      pairwiseMode=True)
+        alignment += src
+
+        t0 = time.time()
+        fn(alignment, src, dest, intervals.tolist())
+        alignment.build()
+        elapsed = time.time() - t0
+
+        print '%-10s %d blocks in %.2f s (%.0f blocks/s)' % \
+              (name, n_blocks, elapsed, n_blocks / elapsed)
+
+if __name__ == '__main__':
+    benchmark()
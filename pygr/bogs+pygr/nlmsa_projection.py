@@ -0,0 +1,57 @@
+"""
+Project many motif hits through a pairwise NLMSA alignment at once.
+
+Querying the NLMSA once per hit (`alignment[site]`, then
+`edge.keys(minAlignSize=len(site))`) costs a tree query and a couple of
+slice objects per hit.  Instead, `get_aligned_blocks` pulls out all of
+the aligned blocks for the source sequence in one query, and
+`project_hits` walks a sorted list of hits along the sorted blocks,
+merge-join style, handing back the aligned target sequence for each hit
+that lies entirely within an aligned block.
+"""
+
+def get_aligned_blocks(alignment, seq):
+    """
+    Return a list of (src_start, src_stop, dest) tuples for every aligned
+    block on the sequence 'seq', sorted by src_start; 'dest' is the
+    aligned slice of the target sequence.
+    """
+    blocks = [ (src.start, src.stop, dest) for (src, dest, edge) in \
+               alignment[seq].edges() ]
+    blocks.sort(key=lambda b: (b[0], b[1]))
+    return blocks
+
+def project_hits(blocks, hits):
+    """
+    Find the aligned target sequence for each hit.
+
+    'blocks' is a sorted list from `get_aligned_blocks`, and 'hits' a list
+    of motility-style (start, stop, orientation, ...) tuples on the
+    source sequence, sorted by start.  Yields (hit, dest_sites) for each
+    hit, where dest_sites is a list of the target slices aligned to it
+    without gaps (reverse-complemented for hits with orientation -1),
+    like `alignment[site].keys(minAlignSize=len(site))`.
+    """
+    active = []                         # blocks that start before the hit
+    j = 0
+    for hit in hits:
+        start, stop, orient = hit[0], hit[1], hit[2]
+
+        while j < len(blocks) and blocks[j][0] <= start:
+            active.append(blocks[j])
+            j += 1
+
+        # drop blocks that end before this hit starts; since the hits are
+        # sorted, they can't contain any later hits either.
+        if active and active[0][1] <= start:
+            active = [ b for b in active if b[1] > start ]
+
+        dest_sites = []
+        for (src_start, src_stop, dest) in active:
+            if stop <= src_stop:
+                site = dest[start - src_start:stop - src_start]
+                if orient == -1:
+                    site = -site
+                dest_sites.append(site)
+
+        yield hit, dest_sites
@@ -0,0 +1,112 @@
+#! /usr/bin/env python2.6
+"""
+Measure the per-record memory footprint of the cogs2 annotation records.
+
+Loads data/NC_000913.ptt and data/NC_003197.ptt 100 times each, once
+with the old dict-backed CogsLine/NamedSpan classes and once with the
+current slotted ones, and reports the average number of bytes held per
+gene record (the record, its attribute dict if any, and every string or
+name tuple it refers to, counting shared objects once).
+"""
+import sys
+import os
+
+import cogs2
+
+N_LOADS = 100
+
+thisdir = os.path.abspath(os.path.dirname(__file__))
+ptt_files = [ os.path.join(thisdir, 'data/NC_000913.ptt'),
+              os.path.join(thisdir, 'data/NC_003197.ptt') ]
+
+#
+# the dict-backed record classes, as they were before __slots__.
+#
+
+class OldSpan:
+    def __init__(self, start, end):
+        self.start = min(start, end)
+        self.end = max(start, end)
+
+class OldNamedSpan(OldSpan):
+    def __init__(self, start, end, name):
+        OldSpan.__init__(self, start, end)
+        self.name = list(name)
+
+class OldCogsLine:
+    def __init__(self, start, end, strand, gene, syn, code, cog, prod):
+        self.start = start
+        self.end = end
+        self.strand = strand.strip()
+        self.gene = gene.strip()
+        self.syn = syn.strip()
+        self.code = code.strip()
+        self.cog = cog.strip()
+        self.prod = prod.strip()
+
+#
+# measurement
+#
+
+def footprint(records):
+    """
+    Total size of the records and everything they refer to, counting
+    each distinct object once.
+    """
+    seen = set()
+    total = 0
+    def add(obj):
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            return sys.getsizeof(obj)
+        return 0
+
+    for r in records:
+        total += add(r)
+        d = getattr(r, '__dict__', None)
+        if d is not None:
+            total += add(d)
+            values = d.values()
+        else:
+            values = [ getattr(r, k) for cls in type(r).__mro__
+                       for k in getattr(cls, '__slots__', ()) ]
+        for v in values:
+            total += add(v)
+            if isinstance(v, (list, tuple)):
+                for x in v:
+                    total += add(x)
+
+    return total
+
+def load_all(cogs_line_class, named_span_class):
+    """
+    Load the PTT files with cogs2 temporarily using the given record
+    classes.
+    """
+    saved = (cogs2.CogsLine, cogs2.NamedSpan)
+    cogs2.CogsLine, cogs2.NamedSpan = cogs_line_class, named_span_class
+    try:
+        lines = []
+        spans = []
+        for i in range(N_LOADS):
+            for filename in ptt_files:
+                content = cogs2.CogsFileContent(filename, 0)
+                lines.extend(content.get_cogs_lines())
+                spans.extend(cogs2.CodingRegionsByGene(content).spans)
+    finally:
+        cogs2.CogsLine, cogs2.NamedSpan = saved
+
+    return lines, spans
+
+def report(label, lines, spans):
+    print '%-8s CogsLine: %5.1f bytes/record; NamedSpan: %5.1f bytes/record' \
+          % (label, footprint(lines) / float(len(lines)),
+             footprint(spans) / float(len(spans)))
+
+if __name__ == '__main__':
+    lines, spans = load_all(OldCogsLine, OldNamedSpan)
+    report('before', lines, spans)
+    del lines, spans
+
+    lines, spans = load_all(cogs2.CogsLine, cogs2.NamedSpan)
+    report('after', lines, spans)
@@ -9,6 +9,10 @@ comparing them.
 
 * `Span(start, end)` -- a class representing intervals from [start:end+1].
 
+* `SpanArray(starts, ends)` -- a set of spans stored as parallel numpy
+  arrays of starts and ends, with vectorized versions of the functions
+  below.
+
 **Functions:**
 
 * `join(list_of_spans, within_distance=0)` -- combine spans that overlap
@@ -23,16 +27,20 @@ comparing them.
   the original list will cover the interval (start, end).
 """
 
+import numpy
+
 #
 # Span
 #
 
-class Span:
+class Span(object):
     """
     A sequence span, representing an interval from [start:end+1].
 
     Create by calling `Span(start, end)`.
     """
+    __slots__ = ('start', 'end')
+
     def __init__(self, start, end):
         self.start = min(start, end)
         self.end = max(start, end)
@@ -199,3 +207,184 @@ def complement(start, end, l):
         complement.append(Span(last, end))
 
     return complement
+
+#
+# SpanArray
+#
+
+class SpanArray:
+    """
+    A set of spans held as two parallel integer arrays, 'starts' and
+    'ends', with the same [start:end+1] convention as `Span`.
+
+    Create by calling `SpanArray(starts, ends)` or
+    `SpanArray.from_spans(list_of_spans)`.  The methods `join`, `cover`,
+    and `complement` work like the module functions of the same name,
+    but on the whole array at once.
+    """
+    def __init__(self, starts, ends):
+        starts = numpy.asarray(starts, dtype=numpy.int64).ravel()
+        ends = numpy.asarray(ends, dtype=numpy.int64).ravel()
+        assert len(starts) == len(ends)
+
+        # same as Span: make sure start <= end.
+        self.starts = numpy.minimum(starts, ends)
+        self.ends = numpy.maximum(starts, ends)
+
+    @classmethod
+    def from_spans(cls, l):
+        starts = numpy.fromiter((span.start for span in l), numpy.int64,
+                                len(l))
+        ends = numpy.fromiter((span.end for span in l), numpy.int64, len(l))
+        return cls(starts, ends)
+
+    def to_spans(self):
+        return [ Span(start, end) for (start, end) in
+                 zip(self.starts.tolist(), self.ends.tolist()) ]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __repr__(self):
+        return "<SpanArray: %d spans>" % (len(self),)
+
+    def sort(self):
+        """
+        Return a copy sorted by start, then end.
+        """
+        order = numpy.lexsort((self.ends, self.starts))
+        return SpanArray(self.starts[order], self.ends[order])
+
+    def join_index(self, within=0):
+        """
+        Join all spans that overlap (or are within 'within' of each
+        other).  Returns the joined SpanArray, sorted by start, and an
+        array giving the index of the joined span that each of the
+        original spans ended up in.
+        """
+        if not len(self):
+            return SpanArray([], []), numpy.zeros(0, dtype=numpy.int64)
+
+        order = numpy.lexsort((self.ends, self.starts))
+        starts = self.starts[order]
+        ends = self.ends[order]
+
+        # a new joined span begins wherever a span starts past the end of
+        # everything before it.
+        reach = numpy.maximum.accumulate(ends)
+        is_first = numpy.ones(len(starts), dtype=bool)
+        is_first[1:] = starts[1:] > reach[:-1] + within
+        firsts = numpy.flatnonzero(is_first)
+
+        joined = SpanArray(starts[firsts],
+                           numpy.maximum.reduceat(ends, firsts))
+
+        group = numpy.empty(len(order), dtype=numpy.int64)
+        group[order] = numpy.cumsum(is_first) - 1
+
+        return joined, group
+
+    def join(self, within=0):
+        """
+        Join all spans that overlap; see `join`.
+        """
+        return self.join_index(within)[0]
+
+    def cover(self):
+        """
+        Construct a single span covering all of the spans; see
+        `cover_spans`.
+        """
+        if not len(self):
+            return None
+        return Span(int(self.starts.min()), int(self.ends.max()))
+
+    def complement(self, start, end):
+        """
+        Return the complement of these spans from start to end; see
+        `complement`.
+        """
+        if not len(self):
+            return SpanArray([start], [end])
+
+        s = self.sort()
+
+        c_starts = [s.ends[:-1]]
+        c_ends = [s.starts[1:]]
+        if start != s.starts[0]:
+            c_starts.insert(0, [start])
+            c_ends.insert(0, [s.starts[0]])
+        if s.ends[-1] != end:
+            c_starts.append([s.ends[-1]])
+            c_ends.append([end])
+
+        return SpanArray(numpy.concatenate(c_starts),
+                         numpy.concatenate(c_ends))
+
+    def union(self, other):
+        """
+        Return the joined union of the two span sets.
+        """
+        return SpanArray(numpy.concatenate((self.starts, other.starts)),
+                         numpy.concatenate((self.ends, other.ends))).join()
+
+    def intersect(self, other):
+        """
+        Return the intersection of the two span sets, as a sorted set of
+        non-overlapping spans.
+        """
+        a = self.join()
+        b = other.join()
+
+        # for each span in a, find the range of spans in b that overlap
+        # it; since b is joined, both its starts and its ends are sorted.
+        lo = numpy.searchsorted(b.ends, a.starts, 'left')
+        hi = numpy.searchsorted(b.starts, a.ends, 'right')
+        counts = numpy.maximum(hi - lo, 0)
+
+        a_i = numpy.repeat(numpy.arange(len(a)), counts)
+        offsets = numpy.arange(counts.sum()) - \
+                  numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        b_i = numpy.repeat(lo, counts) + offsets
+
+        return SpanArray(numpy.maximum(a.starts[a_i], b.starts[b_i]),
+                         numpy.minimum(a.ends[a_i], b.ends[b_i]))
+
+def test():
+    import random
+
+    for i in range(100):
+        l = []
+        for j in range(random.randint(0, 50)):
+            start = random.randint(0, 1000)
+            l.append(Span(start, start + random.randint(0, 50)))
+
+        arr = SpanArray.from_spans(l)
+        for within in (0, 5):
+            expected = [ (s.start, s.end) for s in join(list(l), within) ]
+            got = [ (s.start, s.end) for s in arr.join(within).to_spans() ]
+            assert got == expected, (got, expected)
+
+        expected = [ (s.start, s.end) for s in complement(0, 2000, list(l)) ]
+        got = [ (s.start, s.end) for s in arr.complement(0, 2000).to_spans() ]
+        assert got == expected, (got, expected)
+
+        if l:
+            c = arr.cover()
+            assert (c.start, c.end) == (cover_spans(l).start,
+                                        cover_spans(l).end)
+
+        # check intersect/union against a brute-force base-by-base answer.
+        other = SpanArray(arr.starts + random.randint(-20, 20), arr.ends)
+        def bases(a):
+            s = set()
+            for (start, end) in zip(a.starts.tolist(), a.ends.tolist()):
+                s.update(range(start, end + 1))
+            return s
+        assert bases(arr.intersect(other)) == bases(arr) & bases(other)
+        assert bases(arr.union(other)) == bases(arr) | bases(other)
+
+    print 'SpanArray matches join/complement/cover_spans'
+
+if __name__ == '__main__':
+    test()